@@ -0,0 +1,33 @@
+'''
+Helpers shared by the benchmarks.
+'''
+import time
+
+from kernel_crawler.utils.download import decompress
+
+
+def measure(label, run, size=None):
+    '''
+    Time run(), print the elapsed time (and the throughput over size bytes, if given)
+    and return its result.
+    '''
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    if size is None:
+        print('{:<12} {:>8.3f}s'.format(label, elapsed))
+    else:
+        print('{:<12} {:>8.3f}s  ({:.1f} MB/s)'.format(label, elapsed, size / elapsed / 1e6))
+    return result
+
+
+def run_files(benchmark, paths):
+    '''
+    Call benchmark(path, data) on the (decompressed) contents of each file
+    and return the combined exit status.
+    '''
+    status = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            status |= benchmark(path, decompress(path, f.read()))
+    return status
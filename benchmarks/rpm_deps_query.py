@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+'''
+Measure the recursive dependency query of RpmRepository.parse_repo_db
+on a primary_db as published by createrepo, and after index_repo_db.
+
+Usage (from the repository root): python -m benchmarks.rpm_deps_query primary.sqlite[.bz2|.gz|.xz] ...
+'''
+import os
+import sqlite3
+import sys
+import tempfile
+
+from benchmarks.common import measure, run_files
+from kernel_crawler.rpm import RpmRepository
+
+
+def benchmark(path, data):
+    print('{}: {:.1f} MB'.format(path, len(data) / 1e6))
+    fd, tmp = tempfile.mkstemp(suffix='.sqlite')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        db = sqlite3.connect(tmp)
+        try:
+            plain = measure('plain', lambda: RpmRepository.parse_repo_db(db))
+            measure('indexing', lambda: RpmRepository.index_repo_db(db))
+            indexed = measure('indexed', lambda: RpmRepository.parse_repo_db(db))
+        finally:
+            db.close()
+    finally:
+        os.unlink(tmp)
+    if sorted(plain) != sorted(indexed):
+        print('results differ!')
+        return 1
+    return 0
+
+
+def main(paths):
+    if not paths:
+        print(__doc__)
+        return 1
+    return run_files(benchmark, paths)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+'''
+Measure the throughput of the Debian Packages parser against the original line-based one.
+
+Usage (from the repository root): python -m benchmarks.scan_packages [Packages|Packages.xz|Packages.gz ...]
+
+Without arguments, a synthetic index resembling Ubuntu main is generated.
+'''
+import sys
+
+from benchmarks.common import measure, run_files
+from kernel_crawler.deb import DebRepository
+from kernel_crawler.utils.py23 import make_string
+
+CHUNK_SIZE = 1 << 16
+
+
+def iter_lines(chunks):
+    '''
+    Split an iterator of byte chunks into lines, keeping the line endings, as the legacy parser expects.
+    '''
+    tail = b''
+    for chunk in chunks:
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if tail:
+        yield tail
+
+
+def legacy_scan_packages(stream):
+    '''
+    The line-based parser DebRepository.scan_packages used to be.
+    '''
+    current_package = {}
+    packages = {}
+    for line in stream:
+        line = make_string(line)
+        line = line.rstrip()
+        if line == '':
+            name = current_package['Package']
+            depends = current_package.get('Depends', [])
+            packages[name] = {
+                'Depends': set(depends),
+                'Version': current_package['Version'],
+                'Filename': current_package['Filename'],
+            }
+            current_package = {}
+            continue
+        # ignore multiline values
+        if line.startswith(' '):
+            continue
+        try:
+            key, value = line.split(': ', 1)
+            if key in ('Provides', 'Depends'):
+                value = value.split(', ')
+        except ValueError:
+            # Just skip the line if it is malformed
+            continue
+        current_package[key] = value
+
+    if current_package:
+        name = current_package['Package']
+        depends = current_package.get('Depends', [])
+        packages[name] = {
+            'Depends': set(depends),
+            'Version': current_package['Version'],
+            'Filename': current_package['Filename'],
+        }
+
+    return packages
+
+
+def synthetic_index(count=60000):
+    stanzas = []
+    for i in range(count):
+        name = 'libexample{}'.format(i)
+        version = '1.{}-0ubuntu1'.format(i)
+        stanzas.append(
+            'Package: {name}\n'
+            'Architecture: amd64\n'
+            'Version: {version}\n'
+            'Priority: optional\n'
+            'Section: libs\n'
+            'Source: example\n'
+            'Origin: Ubuntu\n'
+            'Maintainer: Ubuntu Developers <ubuntu-devel-discuss@lists.ubuntu.com>\n'
+            'Installed-Size: 1234\n'
+            'Depends: libc6 (>= 2.34), libgcc-s1 (>= 3.0), libstdc++6 (>= 12)\n'
+            'Filename: pool/main/e/example/{name}_{version}_amd64.deb\n'
+            'Size: 123456\n'
+            'MD5sum: 0123456789abcdef0123456789abcdef\n'
+            'SHA1: 0123456789abcdef0123456789abcdef01234567\n'
+            'SHA256: 0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef\n'
+            'Description: example library\n'
+            ' A longer description of the example library,\n'
+            ' spanning a few lines.\n'
+            'Task: ubuntu-desktop\n'
+            '\n'.format(name=name, version=version))
+    return ''.join(stanzas).encode('utf-8')
+
+
+def benchmark(name, data):
+    print('{}: {:.1f} MB'.format(name, len(data) / 1e6))
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    legacy = measure('legacy', lambda: legacy_scan_packages(iter_lines(chunks)), len(data))
+    current = measure('current', lambda: DebRepository.scan_packages(chunks), len(data))
+    measure('kernel-only', lambda: DebRepository.scan_packages(chunks, kernel_only=True), len(data))
+    if legacy != current:
+        print('results differ!')
+        return 1
+    return 0
+
+
+def main(paths):
+    if not paths:
+        return benchmark('synthetic', synthetic_index())
+    return run_files(benchmark, paths)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -11,10 +11,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import requests
-from bs4 import BeautifulSoup
 import re
 
-from kernel_crawler.utils.download import get_url
+from kernel_crawler.utils.download import open_url
+from kernel_crawler.utils.listing import iter_hrefs
 from . import repo
 
 class ArchLinuxRepository(repo.Repository):
@@ -45,16 +45,21 @@ class ArchLinuxRepository(repo.Repository):
         packages = {}
 
         try:
-            soup = BeautifulSoup(get_url(self.base_url), features='lxml')
-            for a in soup.find_all('a', href=True):
-                package = a['href']
-                # skip .sig and .. links
-                if not package.endswith('.sig') and package != '../':
+            # a missing archive directory is expected, it just has no packages
+            listing = open_url(self.base_url, missing_ok=True)
+            if listing is None:
+                return packages
+            # the listing holds thousands of packages, its links are picked as it is downloaded
+            for package in iter_hrefs(listing):
+                # skip .sig links
+                if not package.endswith('.sig'):
                     parsed_kernel_release = self.parse_kernel_release(package)
 
                     packages.setdefault(parsed_kernel_release, set()).add(self.base_url + package)
         except requests.HTTPError:
             pass
+        except requests.exceptions.RequestException as e:
+            print(f"[ERROR] Request failed for {self.base_url}: {e}")
 
         return packages
 
@@ -16,11 +16,11 @@ import os
 import re
 import sys
 
-import requests
 import rpmfile
 from click import progressbar as ProgressBar
 
 from .git import GitMirror
+from kernel_crawler.utils.download import fetch
 
 
 class BottleRocketMirror(GitMirror):
@@ -32,10 +32,9 @@ class BottleRocketMirror(GitMirror):
         if source is None:
             return None
 
-        alkernel = requests.get(source, timeout = 15)
-        alkernel.raise_for_status()
+        alkernel = fetch(source, missing_ok=False)
         with open('/tmp/alkernel.rpm', 'wb') as f:
-            f.write(alkernel.content)
+            f.write(alkernel)
 
         with rpmfile.open('/tmp/alkernel.rpm') as rpm:
             # Extract a fileobject from the archive
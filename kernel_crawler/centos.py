@@ -27,6 +27,16 @@ def v6_or_v7(ver):
     return ver.startswith('6') or ver.startswith('7')
 
 class CentosMirror(repo.Distro):
+    mirror_groups = [
+        ['http://vault.centos.org/centos/', 'http://archive.kernel.org/centos/'],
+        [
+            'http://elrepo.org/linux/kernel/',
+            'http://mirrors.coreix.net/elrepo/kernel/',
+            'http://mirror.rackspace.com/elrepo/kernel/',
+            'http://linux-mirrors.fnal.gov/linux/elrepo/kernel/',
+        ],
+    ]
+
     def __init__(self, arch):
         mirrors = [
             # CentOS 6 + 7
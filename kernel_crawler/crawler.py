@@ -11,8 +11,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from requests.exceptions import ConnectTimeout, ReadTimeout, Timeout, RequestException, ConnectionError
+from . import debstore
 from . import repo
+from .utils import download, parallel
 from .minikube import MinikubeMirror
 from .aliyunlinux import AliyunLinuxMirror
 from .almalinux import AlmaLinuxMirror
@@ -80,42 +84,86 @@ def to_driverkit_config(d, res):
 
     return dk_configs
 
-def crawl_kernels(distro, version, arch, images):
-    ret = {}
-
-    for distname, dist in DISTROS.items():
-        if distname == distro or distro == "*":
-            try:
-                # If the distro requires an image (Redhat only so far), we need to amalgamate
-                # the kernel versions from the supplied images before choosing the output.
-                if issubclass(dist, repo.ContainerDistro):
-                    if images:
-                        kv = {}
-                        for image in images:
-                            d = dist(image)
-                            if len(kv) == 0:
-                                kv = d.get_kernel_versions()
-                            else:
-                                kv.update(d.get_kernel_versions())
-                        # We should now have a list of all kernel versions for the supplied images
-                        res = kv
+def crawl_distro(distname, version, arch, images):
+    dist = DISTROS[distname]
+    try:
+        # If the distro requires an image (Redhat only so far), we need to amalgamate
+        # the kernel versions from the supplied images before choosing the output.
+        if issubclass(dist, repo.ContainerDistro):
+            if images:
+                kv = {}
+                for image in images:
+                    d = dist(image)
+                    if len(kv) == 0:
+                        kv = d.get_kernel_versions()
                     else:
-                        d = None
-                else:
-                    d = dist(arch)
-                    res = d.get_package_tree(version)
-
-                if d and res:
-                    ret[distname] = to_driverkit_config(d, res)
-
-            except (ConnectTimeout, ReadTimeout, Timeout):
-                print(f"[ERROR] Timeout while fetching data for distro '{distname}'")
-            except ConnectionError:
-                print(f"[ERROR] Network unreachable or host down for distro '{distname}'")
-            except RequestException as e:
-                print(f"[ERROR] Request failed for distro '{distname}': {e}")
+                        kv.update(d.get_kernel_versions())
+                # We should now have a list of all kernel versions for the supplied images
+                res = kv
+            else:
+                d = None
+        else:
+            d = dist(arch)
+            res = d.get_package_tree(version)
+
+        if d and res:
+            return to_driverkit_config(d, res)
+
+    except (ConnectTimeout, ReadTimeout, Timeout):
+        print(f"[ERROR] Timeout while fetching data for distro '{distname}'")
+    except ConnectionError:
+        print(f"[ERROR] Network unreachable or host down for distro '{distname}'")
+    except RequestException as e:
+        print(f"[ERROR] Request failed for distro '{distname}': {e}")
+    except Exception as e:
+        # Catch-all for unexpected issues
+        print(f"[ERROR] Unexpected error in distro '{distname}': {e}")
+    return None
+
+def _init_worker(download_settings, parallel_settings, debstore_settings):
+    # worker processes must not share the HTTP connections of the parent,
+    # and do not inherit its module state when not forked
+    download.configure(**download_settings)
+    parallel.configure(**parallel_settings)
+    debstore.configure(**debstore_settings)
+
+def _crawl_distro_worker(distname, version, arch, images):
+    before = download.connection_stats()
+    res = crawl_distro(distname, version, arch, images)
+    after = download.connection_stats()
+    return res, {key: after[key] - before[key] for key in ('connections', 'requests')}
+
+def iter_crawl_kernels(distro, version, arch, images, jobs=1):
+    """
+    Crawl the requested distros and yield (distname, driverkit configs) pairs as soon as each one is done.
+    With jobs > 1, every distro is crawled in its own worker process, so the pairs come in completion order.
+    """
+    distnames = [distname for distname in DISTROS if distname == distro or distro == "*"]
+    if jobs <= 1 or len(distnames) <= 1:
+        for distname in distnames:
+            yield distname, crawl_distro(distname, version, arch, images)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(distnames)), initializer=_init_worker,
+                             initargs=(download.settings(), parallel.settings(), debstore.settings())) as executor:
+        futures = {executor.submit(_crawl_distro_worker, distname, version, arch, images): distname
+                   for distname in distnames}
+        for future in as_completed(futures):
+            distname = futures[future]
+            try:
+                res, stats = future.result()
             except Exception as e:
-                # Catch-all for unexpected issues
-                print(f"[ERROR] Unexpected error in distro '{distname}': {e}")
+                # the worker itself died, e.g. it was killed by the OOM killer
+                print(f"[ERROR] Worker failed for distro '{distname}': {e}")
+                continue
+            download.add_connection_stats(stats)
+            yield distname, res
+
+def crawl_kernels(distro, version, arch, images, jobs=1):
+    ret = {}
+    for distname, res in iter_crawl_kernels(distro, version, arch, images, jobs):
+        if res is not None:
+            ret[distname] = res
 
-    return ret
+    # keep the DISTROS order, whatever order the distros completed in
+    return {distname: ret[distname] for distname in DISTROS if distname in ret}
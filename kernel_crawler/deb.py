@@ -15,17 +15,24 @@
 
 from __future__ import print_function
 
+import hashlib
+import json
+import os
 import re
 import sys
+import tempfile
+import time
+from email.utils import parsedate_to_datetime
 
 import click
 import logging
 import requests
 
-from lxml import html
-
 from . import repo
-from kernel_crawler.utils.download import get_first_of, get_url
+from kernel_crawler.utils.download import cache_path, cache_stored, file_sha256, get_url, open_url, stream_url, write_atomic
+from kernel_crawler.utils.listing import iter_hrefs
+from kernel_crawler.utils.parallel import progress_imap
+from kernel_crawler.utils import memo, pdiff
 from kernel_crawler.utils.py23 import make_bytes, make_string
 import pprint
 
@@ -37,57 +44,329 @@ class IncompletePackageListException(Exception):
     pass
 
 
+def build_release_index(packages):
+    """
+    Map the kernel release of every linux-headers-<release> package of packages which also has
+    a linux-modules-<release> (or else a linux-image-<release>) package to the names of both packages.
+    """
+    index = {}
+    for name in packages:
+        if not name.startswith('linux-headers-'):
+            continue
+        release = name.replace('linux-headers-', '')
+        for prefix in ('linux-modules-', 'linux-image-'):
+            if prefix + release in packages:
+                index[release] = (name, prefix + release)
+                break
+    return index
+
+
+class PackageDB(dict):
+    """
+    Package DB of a repository (package name -> metadata) along with its release index
+    (see build_release_index), built once when the DB is loaded.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PackageDB, self).__init__(*args, **kwargs)
+        self.release_index = build_release_index(self)
+
+
+class DependencyGraph(object):
+    """
+    Dependency graph of the kernel packages of a package DB, whose nodes are package names.
+
+    Only the dependencies passing is_kernel_package are edges, and the successors of a package
+    are only looked up when it is first reached. The transitive closures are computed in a single
+    iterative pass over the strongly connected components (Tarjan's algorithm), so each package
+    is resolved once no matter how many kernels depend on it, and deep chains cannot hit the recursion limit.
+
+    Subclasses may use other nodes (e.g. debstore.PackageStore) by overriding dependencies(),
+    name(), version() and url().
+    """
+
+    def __init__(self, packages, is_kernel_package):
+        self.packages = packages
+        self.is_kernel_package = is_kernel_package
+        # node -> (successors, first dependency missing from the DB or None)
+        self._edges = {}
+        # node -> frozenset of the nodes it transitively depends on, including itself
+        self._closures = {}
+        # node -> a dependency missing from the DB somewhere in its closure, or None
+        self._missing = {}
+
+    def dependencies(self, node):
+        """
+        Return the nodes of the kernel packages node directly depends on,
+        and the name of the first one missing from the DB (or None).
+        """
+        successors = []
+        missing = None
+        for dep in self.packages[node]['Depends']:
+            if not self.is_kernel_package(dep):
+                continue
+            # Note: this always takes the first branch of alternative
+            # dependencies like 'foo|bar'. In the kernel crawler, we don't care
+            dep = dep.split(None, 1)[0]
+            if dep in self.packages:
+                successors.append(dep)
+            elif missing is None:
+                missing = dep
+        return tuple(successors), missing
+
+    def name(self, node):
+        return node
+
+    def version(self, node):
+        return self.packages[node]['Version']
+
+    def url(self, node):
+        return self.packages[node]['URL']
+
+    def _node_edges(self, node):
+        edges = self._edges.get(node)
+        if edges is None:
+            edges = self._edges[node] = self.dependencies(node)
+        return edges
+
+    def successors(self, node):
+        """
+        Return the nodes of the kernel packages node directly depends on.
+        """
+        return self._node_edges(node)[0]
+
+    def closure(self, node):
+        """
+        Return the set of the kernel packages node transitively depends on, including node itself.
+        Raise IncompletePackageListException if any of them depends on a package missing from the DB.
+        """
+        if node not in self._closures:
+            self._resolve(node)
+        missing = self._missing[node]
+        if missing is not None:
+            raise IncompletePackageListException("{} not in package list".format(missing))
+        return self._closures[node]
+
+    def _resolve(self, root):
+        index = {root: 0}
+        lowlink = {root: 0}
+        stack = [root]
+        on_stack = {root}
+        work = [(root, iter(self.successors(root)))]
+        while work:
+            node, successors = work[-1]
+            for succ in successors:
+                if succ in self._closures:
+                    continue
+                if succ not in index:
+                    index[succ] = lowlink[succ] = len(index)
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(self.successors(succ))))
+                    break
+                if succ in on_stack:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    self._close_component(stack, on_stack, node)
+
+    def _close_component(self, stack, on_stack, node):
+        # the component of node is on top of the stack, and every other component
+        # it depends on was already closed (Tarjan emits them in reverse topological order)
+        component = set()
+        while True:
+            member = stack.pop()
+            on_stack.discard(member)
+            component.add(member)
+            if member == node:
+                break
+        closure = set(component)
+        missing = None
+        for member in component:
+            successors, member_missing = self._node_edges(member)
+            if missing is None:
+                missing = member_missing
+            for succ in successors:
+                if succ not in component:
+                    closure |= self._closures[succ]
+                    if missing is None:
+                        missing = self._missing[succ]
+        closure = frozenset(closure)
+        for member in component:
+            self._closures[member] = closure
+            self._missing[member] = missing
+
+
+class DebRelease(object):
+    """
+    Parsed Release file of a dist: its single-line fields and the SHA256 digests
+    of the index files it references.
+    """
+
+    def __init__(self, content):
+        self.fields = {}
+        # path (relative to the dist) -> (sha256, size)
+        self.sha256 = {}
+        field = None
+        for line in make_string(content).splitlines():
+            if line.startswith(' '):
+                if field == 'SHA256':
+                    try:
+                        digest, size, path = line.split()
+                        self.sha256[path] = (digest, int(size))
+                    except ValueError:
+                        continue
+                continue
+            try:
+                field, value = line.split(':', 1)
+            except ValueError:
+                field = None
+                continue
+            value = value.strip()
+            if value:
+                self.fields[field] = value
+
+    def components(self):
+        return self.fields.get('Components', '').split()
+
+    def by_hash(self):
+        """
+        Return True if the files of the dist can also be fetched by their digest, under by-hash/SHA256/.
+        """
+        return self.fields.get('Acquire-By-Hash', '').lower() == 'yes'
+
+    def expired(self):
+        """
+        Return True if the Release file is past its Valid-Until date, i.e. the suite is no longer updated.
+        """
+        try:
+            return parsedate_to_datetime(self.fields['Valid-Until']).timestamp() < time.time()
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    def index_files(self, directory):
+        """
+        Return the digests of the files directly in directory (and of its pdiff index, Packages.diff/Index),
+        keyed by their path relative to directory.
+        """
+        files = {}
+        for path, digest in self.sha256.items():
+            if not path.startswith(directory):
+                continue
+            name = path[len(directory):]
+            if '/' not in name or name == 'Packages.diff/Index':
+                files[name] = digest
+        return files
+
+
 class DebRepository(repo.Repository):
 
-    def __init__(self, repo_base, repo_name):
+    # the compressed variants of the package index we can read
+    PACKAGE_INDEX_NAMES = ('Packages.xz', 'Packages.gz', 'Packages.bz2')
+
+    def __init__(self, repo_base, repo_name, index_files=None, by_hash=False):
         self.repo_base = repo_base
         self.repo_name = repo_name
+        # digests of the Packages files, as listed in the Release file
+        self.index_files = index_files or {}
+        # whether the Release file advertises by-hash URLs
+        self.by_hash = by_hash
 
     def __str__(self):
         return self.repo_base + self.repo_name
 
+    def url_prefix(self):
+        return self.repo_base
+
+    def index_digest(self):
+        """
+        Return (file name, sha256) of the package index as listed in the Release file, or None.
+        """
+        for name in ('Packages', 'Packages.xz', 'Packages.gz'):
+            if name in self.index_files:
+                return name, self.index_files[name][0]
+        return None
+
+    def memo_key(self, filter=''):
+        """
+        Return (key identifying the package tree of this repository, checksum of its current contents), or None
+        if the Release file did not list the package index. The digest of the index changes whenever
+        the repository does, so a result stored with the same checksum can be reused as is.
+        """
+        digest = self.index_digest()
+        if not digest:
+            return None
+        return [type(self).__name__, str(self), filter], '{}:{}'.format(*digest)
+
+    def fingerprint(self, filter=''):
+        """
+        Repositories with the same package index (e.g. a suite available on several mirrors)
+        have the same contents. This does not need any request, the Release file was already read.
+        """
+        digest = self.index_digest()
+        if not digest:
+            return None
+        return (type(self).__name__,) + digest + (filter,)
+
+    # matches either a field we care about or an empty (possibly whitespace-only) line ending a stanza,
+    # each of them right after a newline; continuation lines start with a space, so they never match
+    PACKAGE_FIELD = re.compile(rb'\n(?:(Package|Version|Filename|Depends): ([^\n]*)|[ \t\r]*(?=\n))')
+
     @classmethod
-    def scan_packages(cls, stream):
+    def scan_packages(cls, stream, kernel_only=False):
         """
         Parse a Packages file into individual packages metadata.
+        stream is an iterable of pieces of the file (lines or arbitrary chunks, bytes or str).
+        With kernel_only, only the packages that may end up in a kernel package tree
+        (see is_kernel_stanza) are kept, which is a tiny fraction of a whole distro.
+
+        This is the hot spot of a Debian crawl, so the file is never split into lines:
+        a single regex scan picks the fields we need and the stanza boundaries out of the raw bytes.
         """
-        current_package = {}
         packages = {}
-        for line in stream:
-            line = make_string(line)
-            line = line.rstrip()
-            if line == '':
-                name = current_package['Package']
-                depends = current_package.get('Depends', [])
-                packages[name] = {
-                    'Depends': set(depends),
-                    'Version': current_package['Version'],
-                    'Filename': current_package['Filename'],
-                }
-                current_package = {}
-                continue
-            # ignore multiline values
-            if line.startswith(' '):
-                continue
-            try:
-                key, value = line.split(': ', 1)
-                if key in ('Provides', 'Depends'):
-                    value = value.split(', ')
-            except ValueError:
-                # Just skip the line if it is malformed
-                continue
-            current_package[key] = value
+        # fields of the current stanza, which may span several pieces
+        fields = {}
+        tail = b''
+        for piece in stream:
+            data = tail + make_bytes(piece)
+            # only scan complete lines, the last one may continue in the next piece
+            end = data.rfind(b'\n') + 1
+            fields = cls._scan_lines(data[:end], fields, packages, kernel_only)
+            tail = data[end:]
+        fields = cls._scan_lines(tail, fields, packages, kernel_only)
+        if fields:
+            cls._add_package(packages, fields, kernel_only)
+        return PackageDB(packages)
 
-        if current_package:
-            name = current_package['Package']
-            depends = current_package.get('Depends', [])
-            packages[name] = {
-                'Depends': set(depends),
-                'Version': current_package['Version'],
-                'Filename': current_package['Filename'],
-            }
+    @classmethod
+    def _scan_lines(cls, data, fields, packages, kernel_only):
+        for key, value in cls.PACKAGE_FIELD.findall(b'\n' + data):
+            if key:
+                value = value.rstrip()
+                # a field without a value is malformed, skip it
+                if value:
+                    fields[key] = value
+                continue
+            if fields:
+                cls._add_package(packages, fields, kernel_only)
+                fields = {}
+        return fields
 
-        return packages
+    @classmethod
+    def _add_package(cls, packages, fields, kernel_only):
+        name = fields[b'Package'].decode('utf-8')
+        if kernel_only and not cls.is_kernel_stanza(name):
+            return
+        depends = fields.get(b'Depends')
+        packages[name] = {
+            'Depends': set(depends.decode('utf-8').split(', ')) if depends else set(),
+            'Version': fields[b'Version'].decode('utf-8'),
+            'Filename': fields[b'Filename'].decode('utf-8'),
+        }
 
     KERNEL_PACKAGE_PATTERN = re.compile(r'^linux-.*?-[0-9]\.[0-9]+\.[0-9]+')
     KERNEL_RELEASE_UPDATE = re.compile(r'^([0-9]+\.[0-9]+\.[0-9]+-[0-9]+)\.(.+)')
@@ -100,105 +379,233 @@ class DebRepository(repo.Repository):
                 'linux-source' not in dep and
                 'tools' not in dep) or 'linux-kbuild' in dep
 
+    # the packages get_package_list() starts the dependency trees from
+    KERNEL_ROOT_PREFIXES = ('linux-headers-', 'linux-modules-', 'linux-image-')
+
+    @classmethod
+    def is_kernel_stanza(cls, name):
+        """
+        Whether the package called name may be part of a kernel package tree, i.e. whether it is
+        either the root of one or a kernel package that the dependency walk would follow.
+        """
+        return name.startswith(cls.KERNEL_ROOT_PREFIXES) or bool(cls.is_kernel_package(name))
+
     @classmethod
     def filter_kernel_packages(cls, deps):
         return [dep for dep in deps if (cls.is_kernel_package(dep))]
 
     @classmethod
-    def transitive_dependencies(cls, packages, pkg_name, dependencies=None, level=0, cache=None):
-        if cache is None:
-            cache = {}
-        if dependencies is None:
-            dependencies = {pkg_name}
-        pkg_deps = cls.filter_kernel_packages(packages[pkg_name]['Depends'])
-        for dep in pkg_deps:
-            dep = dep.split(None, 1)[0]
-            # Note: this always takes the first branch of alternative
-            # dependencies like 'foo|bar'. In the kernel crawler, we don't care
-            #
-            # also, apparently libc6 and libgcc1 depend on each other
-            # so we only filter for kernel packages
-            if dep in packages:
-                if dep not in dependencies:
-                    if dep not in cache:
-                        dependencies |= {dep}
-                        deps = {dep}
-                        deps |= cls.transitive_dependencies(packages, dep, dependencies, level + 1, cache)
-                        cache[dep] = deps
-                    dependencies |= cache[dep]
-            else:
-                raise (IncompletePackageListException("{} not in package list".format(dep)))
-        return dependencies
+    def dependency_graph(cls, packages):
+        """
+        Return the DependencyGraph of packages, unless it already is one.
+        """
+        if isinstance(packages, DependencyGraph):
+            return packages
+        # apparently libc6 and libgcc1 depend on each other,
+        # so we only follow dependencies on kernel packages
+        return DependencyGraph(packages, cls.is_kernel_package)
+
+    @classmethod
+    def transitive_dependencies(cls, packages, pkg_name):
+        # packages is either a package DB or its DependencyGraph
+        return set(cls.dependency_graph(packages).closure(pkg_name))
 
     @classmethod
     def get_package_deps(cls, packages, pkg):
-        all_deps = set()
-        if not cls.is_kernel_package(pkg):
+        graph = cls.dependency_graph(packages)
+        if not cls.is_kernel_package(graph.name(pkg)):
             return set()
-        for dep in cls.filter_kernel_packages(cls.transitive_dependencies(packages, pkg)):
-            all_deps.add(packages[dep]['URL'])
-        return all_deps
+        return {graph.url(dep) for dep in graph.closure(pkg) if cls.is_kernel_package(graph.name(dep))}
 
 
     # this method returns a list of available kernel-looking package _names_
     # (i.e., without version) available from within an individual .deb repository
     def get_package_list(self, packages, package_filter):
-        kernel_packages = []
-        for p in packages.keys():
-            if not p.startswith('linux-headers-'):
-                continue
-            release = p.replace('linux-headers-', '')
-            if 'linux-modules-{}'.format(release) in packages:
-                kernel_packages.append(p)
-                kernel_packages.append('linux-modules-{}'.format(release))
-            elif 'linux-image-{}'.format(release) in packages:
-                kernel_packages.append(p)
-                kernel_packages.append('linux-image-{}'.format(release))
+        release_index = getattr(packages, 'release_index', None)
+        if release_index is None:
+            release_index = build_release_index(packages)
 
         if not package_filter:
+            kernel_packages = [name for names in release_index.values() for name in names]
             logger.debug("kernel_packages[{}]=\n{}".format(str(self), pp.pformat(kernel_packages)))
             return kernel_packages
             # return [dep for dep in kernel_packages if self.is_kernel_package(dep) and not dep.endswith('-dbg')]
 
-        kernel_packages = set(kernel_packages)
-        linux_modules = 'linux-modules-{}'.format(package_filter)
-        linux_headers = 'linux-headers-{}'.format(package_filter)
-        linux_image = 'linux-image-{}'.format(package_filter)
         # if the filter is an exact match on package name, just pick that
         if package_filter in packages:
             return [package_filter]
-        # if the filter is an exact match on the suffix for headers and modules, use both
-        elif linux_modules in kernel_packages and linux_headers in kernel_packages:
-            return [linux_modules, linux_headers]
-        # same for image
-        elif linux_image in kernel_packages and linux_headers in kernel_packages:
-            return [linux_image, linux_headers]
+        # if the filter is an exact match on the suffix for headers and modules (or image), use both
+        names = release_index.get(package_filter)
+        if names and names[0] == 'linux-headers-{}'.format(package_filter):
+            headers, modules_or_image = names
+            return [modules_or_image, headers]
         # otherwise just pick up anything matching it
-        else:
-            return [k for k in kernel_packages if package_filter in k]
+        return [name for names in release_index.values() for name in names if package_filter in name]
 
-    def get_raw_package_db(self):
+    def package_index_path(self):
+        """
+        Return the path where the uncompressed Packages file is kept in the cache between runs, so that
+        it can be updated with pdiffs, or None if the cache is disabled, the repository publishes no pdiffs
+        or the Release file does not list the digest of the uncompressed file (which every update is verified against).
+        """
+        if 'Packages' not in self.index_files or 'Packages.diff/Index' not in self.index_files:
+            return None
+        store = cache_path('pdiff')
+        if store is None:
+            return None
+        return os.path.join(store, hashlib.sha256(str(self).encode('utf-8')).hexdigest())
+
+    def update_package_index(self, path):
+        """
+        Bring the Packages file kept at path up to date by applying the pdiffs published since it was stored
+        (see Packages.diff/Index). Return True if it then matches the digest listed in the Release file.
+        """
+        digest = self.index_files['Packages'][0]
         try:
-            repo_packages = get_first_of([
-                self.repo_base + self.repo_name + '/Packages.xz',
-                self.repo_base + self.repo_name + '/Packages.gz',
-            ])
-        except requests.HTTPError:
-            return {}
-
-        if repo_packages:
-            repo_packages = repo_packages.splitlines(True)
-            packages = self.scan_packages(repo_packages)
-            for name, details in packages.items():
-                details['URL'] = self.repo_base + details['Filename']
-            return packages
+            current = file_sha256(path)
+        except OSError:
+            return False
+        if current == digest:
+            os.utime(path)
+            return True
+
+        index = get_url(self.repo_base + self.repo_name + 'Packages.diff/Index')
+        if not index:
+            return False
+        index = pdiff.PdiffIndex(index)
+        names = index.patches_from(current)
+        if not names:
+            return False
+        # the ed scripts address lines anywhere in the file, so only a stale copy is ever loaded as a whole
+        try:
+            with open(path, 'rb') as f:
+                lines = f.readlines()
+        except OSError:
+            return False
+        try:
+            for name in names:
+                patch = get_url(self.repo_base + self.repo_name + 'Packages.diff/' + name + '.gz')
+                if patch is None:
+                    return False
+                if name in index.patches and hashlib.sha256(patch).hexdigest() != index.patches[name]:
+                    print(f"[ERROR] Checksum mismatch for pdiff {name} of {self}")
+                    return False
+                pdiff.apply(lines, patch)
+        except pdiff.PdiffError as e:
+            print(f"[ERROR] Failed to apply pdiff {name} of {self}: {e}")
+            return False
+        if not self._replace_package_index(lines, path):
+            # e.g. the Release file and the pdiffs were fetched across a mirror update
+            logger.debug("Patched Packages file of {} does not match the Release file".format(self))
+            return False
+        cache_stored(path)
+        logger.debug("Updated the Packages file of {} with {} pdiffs".format(self, len(names)))
+        return True
+
+    def _replace_package_index(self, chunks, path):
+        # write the chunks next to path, replacing it only if they match the digest listed in the Release file
+        hasher = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    f.write(chunk)
+            if hasher.hexdigest() != self.index_files['Packages'][0]:
+                return False
+            os.replace(tmp, path)
+            tmp = None
+            return True
+        finally:
+            if tmp:
+                os.unlink(tmp)
+
+    def store_package_index(self, chunks, path):
+        """
+        Pass the chunks of a downloaded (decompressed) Packages file through, keeping a copy of it at path
+        for update_package_index() if it matches the digest listed in the Release file.
+        """
+        hasher = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    yield chunk
+            if hasher.hexdigest() == self.index_files['Packages'][0]:
+                os.replace(tmp, path)
+                tmp = None
+                cache_stored(path)
+        finally:
+            if tmp:
+                os.unlink(tmp)
+
+    @staticmethod
+    def _read_chunks(path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                yield chunk
+
+    def package_index_urls(self):
+        """
+        Return (url, file name, sha256) for the variants of the package index to try, in order.
+        The variants listed in the Release file are tried smallest first, through their immutable by-hash URL
+        if available (and the usual one otherwise), and verified against their digest.
+        Without a listing, the usual file names are tried blindly.
+        """
+        listed = sorted((size, name, digest) for name, (digest, size) in self.index_files.items()
+                        if name in self.PACKAGE_INDEX_NAMES)
+        if not listed:
+            return [(self.repo_base + self.repo_name + name, name, None) for name in ('Packages.xz', 'Packages.gz')]
+        urls = []
+        for _, name, digest in listed:
+            if self.by_hash:
+                urls.append((self.repo_base + self.repo_name + 'by-hash/SHA256/' + digest, name, digest))
+            urls.append((self.repo_base + self.repo_name + name, name, digest))
+        return urls
+
+    def stream_package_index(self):
+        """
+        Return (url, stream of the decompressed package index) for the first variant of package_index_urls()
+        that exists, or (None, None). Errors are reported and the next variant is tried.
+        """
+        for url, name, digest in self.package_index_urls():
+            try:
+                stream = stream_url(url, sha256=digest, name=name)
+                if stream is not None:
+                    return url, stream
+            except requests.exceptions.RequestException as e:
+                print(f"[ERROR] Request failed for {url}: {e}")
+        return None, None
+
+    def get_raw_package_db(self, kernel_only=True):
+        # the index is decompressed and parsed as it is downloaded, so it is never held in memory as a whole,
+        # and as the crawlers only ever look at kernel packages, by default nothing else is kept either.
+        # With a cache, the previous uncompressed index is kept and updated with pdiffs instead when possible
+        path = self.package_index_path()
+        if path and self.update_package_index(path):
+            url, repo_packages = path, self._read_chunks(path)
         else:
+            url, repo_packages = self.stream_package_index()
+            if repo_packages is None:
+                return {}
+            if path:
+                repo_packages = self.store_package_index(repo_packages, path)
+
+        try:
+            packages = self.scan_packages(repo_packages, kernel_only)
+        except Exception as e:
+            print(f"[ERROR] Failed to read {url}: {e}")
             return {}
+        for name, details in packages.items():
+            details['URL'] = self.repo_base + details['Filename']
+        return packages
 
     @classmethod
     def build_package_tree(cls, packages, package_list):
         # this classmethod takes as input:
-        #  - packages, a dictionary of .deb packages with their metadata
+        #  - packages, a dictionary of .deb packages with their metadata (or its DependencyGraph)
         #  - packages_list, a list of strings (package names)
         # it traverses the dependency chain within the package_list
         # and returns a dictionary of urls:
@@ -208,22 +615,26 @@ class DebRepository(repo.Repository):
         #           'http://security.ubuntu.com/ubuntu/pool/main/l/linux-signed-azure/linux-image-5.15.0-1001-azure_5.15.0-1001.2_amd64.deb'},
 
         deps = {}
-        logger.debug("packages=\n{}".format(pp.pformat(packages)))
-        logger.debug("package_list=\n{}".format(pp.pformat(package_list)))
+        # the graph is shared by all the packages of the list, so common dependencies are only resolved once
+        graph = cls.dependency_graph(packages)
+        if logger.isEnabledFor(logging.DEBUG):
+            # formatting the whole package DB is expensive, only do it when it is logged
+            logger.debug("packages=\n{}".format(pp.pformat(graph.packages)))
+            logger.debug("package_list=\n{}".format(pp.pformat(package_list)))
         with click.progressbar(package_list, label='Building dependency tree', file=sys.stderr,
-                               item_show_func=repo.to_s) as pkgs:
+                               item_show_func=lambda pkg: repo.to_s(pkg if pkg is None else graph.name(pkg))) as pkgs:
             for pkg in pkgs:
-                pv = packages[pkg]['Version']
+                pv = graph.version(pkg)
                 if ":" in pv:
                     pv = pv.split(":")[1]
                 m = cls.KERNEL_RELEASE_UPDATE.match(pv)
                 if m:
                     pv = '{}/{}'.format(m.group(1), m.group(2))
                 try:
-                    logger.debug("Building dependency tree for {}, pv={}".format(str(pkg), pv))
-                    deps.setdefault(pv, set()).update(cls.get_package_deps(packages, pkg))
+                    logger.debug("Building dependency tree for {}, pv={}".format(graph.name(pkg), pv))
+                    deps.setdefault(pv, set()).update(cls.get_package_deps(graph, pkg))
                 except IncompletePackageListException:
-                    logger.debug("No dependencies found for {}, pv={}".format(str(pkg), pv))
+                    logger.debug("No dependencies found for {}, pv={}".format(graph.name(pkg), pv))
                     pass
 
         logger.debug("before pruning, deps=\n{}".format(pp.pformat(deps)))
@@ -238,49 +649,119 @@ class DebRepository(repo.Repository):
         return deps
 
     def get_package_tree(self, filter=''):
+        memo_key = self.memo_key(filter)
+        if memo_key:
+            cached = memo.load('deb', *memo_key)
+            if cached is not None:
+                return cached
         packages = self.get_raw_package_db()
         package_list = self.get_package_list(packages, filter)
-        return self.build_package_tree(packages, package_list)
+        tree = self.build_package_tree(packages, package_list)
+        if memo_key and packages:
+            memo.store('deb', *memo_key, tree)
+        return tree
 
 
 class DebMirror(repo.Mirror):
 
-    def __init__(self, base_url, arch, repo_filter=None):
+    # how long the snapshot of an immutable suite is trusted before checking it again,
+    # in case it only looked immutable because the mirror was out of date
+    SNAPSHOT_TTL = 30 * 24 * 3600
+
+    def __init__(self, base_url, arch, repo_filter=None, archive=False):
         self.base_url = base_url
         if repo_filter is None:
             repo_filter = lambda _: True
         self.repo_filter = repo_filter
+        # an archive (e.g. archive.debian.org) only hosts suites that will never change again
+        self.archive = archive
         super().__init__(arch)
 
     def __str__(self):
         return self.base_url
 
+    def snapshot_path(self, dist):
+        """
+        Return (path, key) of the snapshot of dist in the cache, or None if the cache is disabled.
+        """
+        store = cache_path('suites')
+        if store is None:
+            return None
+        key = [self.base_url, dist, self.arch]
+        digest = hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(store, digest + '.json'), key
+
+    def load_snapshot(self, dist):
+        """
+        Return the repositories of dist as recorded by a previous run if the suite is immutable
+        (see store_snapshot), so that it needs no request at all, or None if it has to be scanned.
+        """
+        path = self.snapshot_path(dist)
+        if path is None:
+            return None
+        path, key = path
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if snapshot.get('key') != key or not snapshot.get('immutable') \
+                or snapshot.get('scanned', 0) + self.SNAPSHOT_TTL < time.time():
+            return None
+        logger.debug("Using the snapshot of {}{} from {}".format(self.base_url, dist, snapshot.get('date')))
+        return {
+            url: DebRepository(self.base_url, url,
+                               {name: tuple(digest) for name, digest in details['index_files'].items()},
+                               details['by_hash'])
+            for url, details in snapshot['repos'].items()
+        }
+
+    def store_snapshot(self, dist, release, repos):
+        """
+        Record the Release date of dist along with its repositories. The suite is immutable
+        if the mirror is an archive or the Release file has expired: nobody updates it anymore.
+        """
+        path = self.snapshot_path(dist)
+        if path is None:
+            return
+        path, key = path
+        snapshot = {
+            'key': key,
+            'date': release.fields.get('Date'),
+            'immutable': self.archive or release.expired(),
+            'scanned': time.time(),
+            'repos': {
+                url: {'index_files': repository.index_files, 'by_hash': repository.by_hash}
+                for url, repository in repos.items()
+            },
+        }
+        write_atomic(path, json.dumps(snapshot).encode('utf-8'))
+        cache_stored(path)
+
     def scan_repo(self, dist):
+        repos = self.load_snapshot(dist)
+        if repos is not None:
+            return repos
         repos = {}
         all_comps = set()
-        release = get_url(self.base_url + dist + 'Release')
-        if release:  # if release exists
-            for line in release.splitlines(False):
-                if line.startswith(make_bytes('Components: ')):
-                    for comp in line.split(None)[1:]:
-                        comp = make_string(comp)
-                        if comp in ('main', 'updates', 'updates/main'):
-                            if dist.endswith('updates/') and comp.startswith('updates/'):
-                                comp = comp.replace('updates/', '')
-                            all_comps.add(comp)
-                    break
+        content = get_url(self.base_url + dist + 'Release')
+        if content:  # if release exists
+            release = DebRelease(content)
+            for comp in release.components():
+                if comp in ('main', 'updates', 'updates/main'):
+                    if dist.endswith('updates/') and comp.startswith('updates/'):
+                        comp = comp.replace('updates/', '')
+                    all_comps.add(comp)
             for comp in all_comps:
-                url = dist + comp + '/binary-' + self.arch + '/'
-                repos[url] = DebRepository(self.base_url, url)
+                index_dir = comp + '/binary-' + self.arch + '/'
+                url = dist + index_dir
+                repos[url] = DebRepository(self.base_url, url, release.index_files(index_dir), release.by_hash())
+            self.store_snapshot(dist, release, repos)
         return repos
 
     def list_repos(self):
         dists_url = self.base_url + 'dists/'
-        dists = requests.get(dists_url, timeout = 15)
-        dists.raise_for_status()
-        dists = dists.content
-        doc = html.fromstring(dists, dists_url)
-        dists = [dist for dist in doc.xpath('/html/body//a[not(@href="../")]/@href')
+        dists = [dist for dist in iter_hrefs(open_url(dists_url, missing_ok=False))
                  if dist.endswith('/')
                  and not dist.startswith('/')
                  and not dist.startswith('?')
@@ -289,16 +770,20 @@ class DebMirror(repo.Mirror):
                  ]
 
         repos = {}
-        with click.progressbar(
-                dists, label='Scanning {}'.format(self.base_url), file=sys.stderr, item_show_func=repo.to_s) as dists:
-            for dist in dists:
-                try:
-                    repos.update(self.scan_repo('dists/{}'.format(dist)))
-                except requests.HTTPError:
-                    pass
-                try:
-                    repos.update(self.scan_repo('dists/{}updates/'.format(dist)))
-                except requests.HTTPError:
-                    pass
+        for dist_repos in progress_imap(self.scan_dist, dists, label='Scanning {}'.format(self.base_url),
+                                        item_show_func=repo.to_s):
+            repos.update(dist_repos)
 
         return sorted(repos.values(), key=str)
+
+    def scan_dist(self, dist):
+        repos = {}
+        try:
+            repos.update(self.scan_repo('dists/{}'.format(dist)))
+        except requests.HTTPError:
+            pass
+        try:
+            repos.update(self.scan_repo('dists/{}updates/'.format(dist)))
+        except requests.HTTPError:
+            pass
+        return repos
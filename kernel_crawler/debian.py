@@ -13,8 +13,8 @@
 
 from . import repo
 from . import deb
-import click
-import sys
+from . import debstore
+from kernel_crawler.utils.parallel import progress_imap
 
 def repo_filter(dist):
     return 'stable' not in dist and 'testing' not in dist and not dist.startswith('Debian')
@@ -33,7 +33,7 @@ class DebianMirror(repo.Distro):
             deb.DebMirror('http://security.debian.org/', arch, repo_filter),
             deb.DebMirror('http://archive.raspberrypi.com/debian/', arch, repo_filter),
             deb.DebMirror('http://security.debian.org/debian-security/', arch, repo_filter),
-            deb.DebMirror('http://archive.debian.org/debian/', arch, repo_filter),
+            deb.DebMirror('http://archive.debian.org/debian/', arch, repo_filter, archive=True),
            
         
         ]
@@ -44,18 +44,29 @@ class DebianMirror(repo.Distro):
     # This is namely required for the linux-kbuild package, which is typically
     # hosted on a different repository compared to the kernel packages
     def get_package_tree(self, version=''):
-        all_packages = {}
-        all_kernel_packages = []
         packages = {}
         repos = self.list_repos()
-        with click.progressbar(repos, label='Listing packages', file=sys.stderr, item_show_func=repo.to_s) as repos:
-            for repository in repos:
-                repo_packages = repository.get_raw_package_db()
-                all_packages.update(repo_packages)
-                kernel_packages = repository.get_package_list(repo_packages, version)
-                all_kernel_packages.extend(kernel_packages)
+        with debstore.open_store(deb.DebRepository.is_kernel_package) as store:
+            originals = repo.dedupe_repos(repos, version)
+            crawled = [repository for repository, original in zip(repos, originals) if repository is original]
+            # package DBs may be downloaded concurrently, but they are loaded in the order of repos,
+            # and each one is only kept in the compact store once loaded
+            repo_dbs = progress_imap(lambda repository: repository.get_raw_package_db(), crawled,
+                                     label='Listing packages', item_show_func=repo.to_s)
+            repo_ids = {}
+            for repository, original in zip(repos, originals):
+                if repository is original:
+                    repo_packages = next(repo_dbs)
+                    kernel_packages = repository.get_package_list(repo_packages, version)
+                    repo_ids[id(repository)] = store.add_repository(repository.repo_base, repo_packages, kernel_packages)
+                else:
+                    # the same repository on another mirror
+                    store.copy_repository(repo_ids[id(original)], repository.repo_base)
+            # finish the progress bar
+            repo_dbs.close()
 
-        for release, dependencies in deb.DebRepository.build_package_tree(all_packages, all_kernel_packages).items():
+            tree = deb.DebRepository.build_package_tree(store.dependency_graph(), store.roots())
+        for release, dependencies in tree.items():
             packages.setdefault(release, set()).update(dependencies)
         return packages
 
@@ -0,0 +1,343 @@
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright (C) 2023 The Falco Authors.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+    # http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import sqlite3
+import sys
+import tempfile
+
+from . import deb
+
+# Store settings, see configure().
+#  - spill_dir: if set, package DBs are merged in an SQLite file under this directory instead of in memory
+_settings = {
+    'spill_dir': None,
+}
+
+
+def configure(**kwargs):
+    unknown = set(kwargs) - set(_settings)
+    if unknown:
+        raise TypeError('Unknown package store settings: {}'.format(', '.join(sorted(unknown))))
+    _settings.update(kwargs)
+
+
+def settings():
+    return dict(_settings)
+
+
+def open_store(is_kernel_package):
+    """
+    Return a new, empty package store: a SqlitePackageStore if spill_dir is set, a PackageStore otherwise.
+    """
+    if _settings['spill_dir']:
+        return SqlitePackageStore(is_kernel_package, _settings['spill_dir'])
+    return PackageStore(is_kernel_package)
+
+
+class _Package(object):
+    # one package of one repository; name and depends are name ids,
+    # previous is the id of the package with the same name loaded before this one (or None)
+    __slots__ = ('name', 'repo', 'version', 'filename', 'depends', 'previous')
+
+    def __init__(self, name, repo, version, filename, depends, previous=None):
+        self.name = name
+        self.repo = repo
+        self.version = version
+        self.filename = filename
+        self.depends = depends
+        self.previous = previous
+
+
+class PackageStore(object):
+    """
+    Compact store of the package DBs of several repositories, used to resolve
+    kernel dependencies across all of them (e.g. linux-kbuild is often in a different repository
+    than the kernel packages).
+
+    Names and versions are interned, packages are slotted records, and only the kernel
+    dependencies of a package are kept, as integer name ids. Every (name, repository) pair
+    is kept, so same-named packages of different repositories do not overwrite each other:
+    a dependency resolves to the package of the same repository if there is one,
+    or else to the one loaded last.
+    """
+
+    def __init__(self, is_kernel_package):
+        self.is_kernel_package = is_kernel_package
+        self._name_ids = {}
+        self._names = []
+        # name id -> id of the package with that name loaded last (or None)
+        self._last = []
+        self._packages = []
+        self._repos = []
+        # ids of the packages the trees start from, in load order
+        self._roots = []
+
+    def __len__(self):
+        return len(self._packages)
+
+    def __repr__(self):
+        return '<PackageStore: {} packages in {} repositories>'.format(len(self._packages), len(self._repos))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        pass
+
+    def _name_id(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name = sys.intern(name)
+            name_id = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+            self._last.append(None)
+        return name_id
+
+    def _add(self, package):
+        package_id = len(self._packages)
+        package.previous = self._last[package.name]
+        self._last[package.name] = package_id
+        self._packages.append(package)
+        return package_id
+
+    def add_repository(self, repo_base, packages, kernel_packages):
+        """
+        Add the raw package DB of a repository, where package URLs are relative to repo_base,
+        along with the names of the kernel packages to start the trees from.
+        Return the id of the repository.
+        """
+        repo_id = len(self._repos)
+        self._repos.append(repo_base)
+        package_ids = {}
+        for name, details in packages.items():
+            depends = tuple(self._name_id(dep.split(None, 1)[0])
+                            for dep in details['Depends'] if self.is_kernel_package(dep))
+            package_ids[name] = self._add(_Package(self._name_id(name), repo_id, sys.intern(details['Version']),
+                                                   details['Filename'], depends))
+        self._roots.extend(package_ids[name] for name in kernel_packages)
+        return repo_id
+
+    def copy_repository(self, repo_id, repo_base):
+        """
+        Add a repository with the same contents as repo_id (e.g. the same suite on another mirror),
+        whose package URLs are relative to repo_base. Return the id of the new repository.
+        """
+        new_repo_id = len(self._repos)
+        self._repos.append(repo_base)
+        copies = {}
+        for package_id, package in enumerate(self._packages):
+            if package.repo == repo_id:
+                copies[package_id] = self._add(_Package(package.name, new_repo_id, package.version,
+                                                        package.filename, package.depends))
+        self._roots.extend(copies[package_id] for package_id in self._roots if package_id in copies)
+        return new_repo_id
+
+    def roots(self):
+        """
+        Return the ids of the packages to start the trees from. When the same version of a package
+        is in several repositories, the one loaded last wins.
+        """
+        last = {}
+        for package_id in self._roots:
+            package = self._packages[package_id]
+            last[package.name, package.version] = package_id
+        roots = []
+        seen = set()
+        for package_id in self._roots:
+            package = self._packages[package_id]
+            key = package.name, package.version
+            if key not in seen:
+                seen.add(key)
+                roots.append(last[key])
+        return roots
+
+    def resolve(self, package_id, name_id):
+        """
+        Return the id of the package called name_id that package_id depends on, or None if there is none.
+        """
+        last = self._last[name_id]
+        repo_id = self._packages[package_id].repo
+        candidate = last
+        while candidate is not None:
+            if self._packages[candidate].repo == repo_id:
+                return candidate
+            candidate = self._packages[candidate].previous
+        return last
+
+    def name(self, package_id):
+        return self._names[self._packages[package_id].name]
+
+    def version(self, package_id):
+        return self._packages[package_id].version
+
+    def url(self, package_id):
+        package = self._packages[package_id]
+        return self._repos[package.repo] + package.filename
+
+    def depends(self, package_id):
+        return self._packages[package_id].depends
+
+    def name_of(self, name_id):
+        return self._names[name_id]
+
+    def dependency_graph(self):
+        return StoreDependencyGraph(self)
+
+
+class StoreDependencyGraph(deb.DependencyGraph):
+    """
+    DependencyGraph of a PackageStore, whose nodes are package ids.
+    """
+
+    def __init__(self, store):
+        super(StoreDependencyGraph, self).__init__(store, store.is_kernel_package)
+
+    def dependencies(self, node):
+        successors = []
+        missing = None
+        for name_id in self.packages.depends(node):
+            dep = self.packages.resolve(node, name_id)
+            if dep is not None:
+                successors.append(dep)
+            elif missing is None:
+                missing = self.packages.name_of(name_id)
+        return tuple(successors), missing
+
+    def name(self, node):
+        return self.packages.name(node)
+
+    def version(self, node):
+        return self.packages.version(node)
+
+    def url(self, node):
+        return self.packages.url(node)
+
+
+class SqlitePackageStore(PackageStore):
+    """
+    PackageStore keeping the packages in a temporary SQLite file under spill_dir instead of in memory,
+    so that only the repository being loaded and the packages the trees are made of are ever in RAM.
+    The file is removed when the store is closed.
+    """
+
+    SCHEMA = """
+        CREATE TABLE names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+        CREATE TABLE repos (id INTEGER PRIMARY KEY, base TEXT NOT NULL);
+        -- package ids grow in load order; copy_of is the package a copied repository got this one from
+        CREATE TABLE packages (id INTEGER PRIMARY KEY, name INTEGER NOT NULL, repo INTEGER NOT NULL,
+                               version TEXT NOT NULL, filename TEXT NOT NULL, copy_of INTEGER);
+        CREATE INDEX packages_name ON packages (name);
+        CREATE INDEX packages_copy_of ON packages (copy_of);
+        CREATE TABLE depends (package INTEGER NOT NULL, name INTEGER NOT NULL);
+        CREATE INDEX depends_package ON depends (package);
+        CREATE TABLE roots (seq INTEGER PRIMARY KEY, package INTEGER NOT NULL);
+    """
+
+    def __init__(self, is_kernel_package, spill_dir):
+        self.is_kernel_package = is_kernel_package
+        os.makedirs(spill_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=spill_dir, prefix='packages-', suffix='.sqlite')
+        os.close(fd)
+        self._db = sqlite3.connect(self.path)
+        # the file is thrown away at the end, it does not need to survive a crash
+        self._db.execute('PRAGMA journal_mode = OFF')
+        self._db.execute('PRAGMA synchronous = OFF')
+        self._db.executescript(self.SCHEMA)
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM packages').fetchone()[0]
+
+    def __repr__(self):
+        return '<SqlitePackageStore: {}>'.format(self.path)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            os.unlink(self.path)
+
+    def _name_ids(self, names):
+        ids = {}
+        for name in names:
+            self._db.execute('INSERT OR IGNORE INTO names (name) VALUES (?)', (name,))
+            ids[name] = self._db.execute('SELECT id FROM names WHERE name = ?', (name,)).fetchone()[0]
+        return ids
+
+    def add_repository(self, repo_base, packages, kernel_packages):
+        with self._db:
+            repo_id = self._db.execute('INSERT INTO repos (base) VALUES (?)', (repo_base,)).lastrowid
+            depends = {name: [dep.split(None, 1)[0] for dep in details['Depends'] if self.is_kernel_package(dep)]
+                       for name, details in packages.items()}
+            name_ids = self._name_ids(set(packages).union(*depends.values()))
+            package_ids = {}
+            for name, details in packages.items():
+                package_id = package_ids[name] = self._db.execute(
+                    'INSERT INTO packages (name, repo, version, filename) VALUES (?, ?, ?, ?)',
+                    (name_ids[name], repo_id, details['Version'], details['Filename'])).lastrowid
+                self._db.executemany('INSERT INTO depends (package, name) VALUES (?, ?)',
+                                     ((package_id, name_ids[dep]) for dep in depends[name]))
+            self._db.executemany('INSERT INTO roots (package) VALUES (?)',
+                                 ((package_ids[name],) for name in kernel_packages))
+        return repo_id
+
+    def copy_repository(self, repo_id, repo_base):
+        with self._db:
+            new_repo_id = self._db.execute('INSERT INTO repos (base) VALUES (?)', (repo_base,)).lastrowid
+            self._db.execute('''INSERT INTO packages (name, repo, version, filename, copy_of)
+                                SELECT name, ?, version, filename, COALESCE(copy_of, id) FROM packages
+                                WHERE repo = ? ORDER BY id''', (new_repo_id, repo_id))
+            self._db.execute('''INSERT INTO roots (package)
+                                SELECT copy.id FROM roots
+                                INNER JOIN packages AS original ON original.id = roots.package
+                                INNER JOIN packages AS copy ON copy.copy_of = COALESCE(original.copy_of, original.id)
+                                WHERE original.repo = ? AND copy.repo = ?
+                                ORDER BY roots.seq''', (repo_id, new_repo_id))
+        return new_repo_id
+
+    def roots(self):
+        # the package loaded last has the highest id
+        return [row[0] for row in self._db.execute('''
+            SELECT MAX(roots.package) FROM roots INNER JOIN packages ON packages.id = roots.package
+            GROUP BY packages.name, packages.version ORDER BY MIN(roots.seq)''')]
+
+    def resolve(self, package_id, name_id):
+        row = self._db.execute('''SELECT id FROM packages WHERE name = ?
+                                  ORDER BY repo = (SELECT repo FROM packages WHERE id = ?) DESC, id DESC
+                                  LIMIT 1''', (name_id, package_id)).fetchone()
+        return row[0] if row else None
+
+    def name(self, package_id):
+        return self._db.execute('''SELECT names.name FROM packages INNER JOIN names ON names.id = packages.name
+                                  WHERE packages.id = ?''', (package_id,)).fetchone()[0]
+
+    def version(self, package_id):
+        return self._db.execute('SELECT version FROM packages WHERE id = ?', (package_id,)).fetchone()[0]
+
+    def url(self, package_id):
+        return self._db.execute('''SELECT repos.base || packages.filename FROM packages
+                                  INNER JOIN repos ON repos.id = packages.repo
+                                  WHERE packages.id = ?''', (package_id,)).fetchone()[0]
+
+    def depends(self, package_id):
+        return tuple(row[0] for row in self._db.execute('''
+            SELECT depends.name FROM packages INNER JOIN depends ON depends.package = COALESCE(packages.copy_of, packages.id)
+            WHERE packages.id = ?''', (package_id,)))
+
+    def name_of(self, name_id):
+        return self._db.execute('SELECT name FROM names WHERE id = ?', (name_id,)).fetchone()[0]
@@ -15,9 +15,10 @@ import os
 import base64
 
 import requests
-from lxml import html
 
 from . import repo
+from kernel_crawler.utils.download import fetch, open_url
+from kernel_crawler.utils.listing import iter_hrefs
 from .repo import Repository, Distro
 from .debian import fixup_deb_arch
 
@@ -30,7 +31,10 @@ class FlatcarRepository(Repository):
         if version not in release:
             return {}
         defconfig = os.path.join(self.base_url, 'flatcar_production_image_kernel_config.txt')
-        defconfig_base64 = base64.b64encode(requests.get(defconfig).content).decode()
+        defconfig = fetch(defconfig)
+        if defconfig is None:
+            return {}
+        defconfig_base64 = base64.b64encode(defconfig).decode()
         return {release: [defconfig_base64]}
 
     def __str__(self):
@@ -47,13 +51,9 @@ class FlatcarMirror(Distro):
 
     def scan_repo(self, base_url):
         try:
-            dists = requests.get(base_url, timeout = 15)
-            dists.raise_for_status()
+            dists = list(iter_hrefs(open_url(base_url, missing_ok=False)))
         except requests.exceptions.RequestException:
             return {}
-        dists = dists.content
-        doc = html.fromstring(dists, base_url)
-        dists = doc.xpath('/html/body//a[not(@href="../")]/@href')
         return [FlatcarRepository('{}{}'.format(base_url, dist.lstrip('./'))) for dist in dists
                 if dist.endswith('/')
                 and dist.startswith('./')
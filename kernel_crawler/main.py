@@ -16,19 +16,39 @@ import json
 import sys
 import click
 
-from .crawler import crawl_kernels, DISTROS
+from .crawler import iter_crawl_kernels, DISTROS
+from . import debstore
+from .utils import download, parallel
 
 logger = logging.getLogger(__name__)
 
 def init_logging(debug):
     level = 'DEBUG' if debug else 'INFO'
-    logger.setLevel(level)
+    # configure the package logger, so that the logs of every module show up
+    package_logger = logging.getLogger(__package__)
+    package_logger.setLevel(level)
     handler = logging.StreamHandler(sys.stderr)
     handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
     handler.setLevel(level)
-    logger.addHandler(handler)
+    package_logger.addHandler(handler)
     logger.debug("DEBUG logging enabled")
 
+def write_json(pairs, out):
+    '''
+    Write the (distname, driverkit configs) pairs to out as a single JSON object, formatted like
+    json.dumps(..., indent=2), flushing each distro as soon as it comes in.
+    '''
+    out.write('{')
+    first = True
+    for distname, res in pairs:
+        if res is None:
+            continue
+        body = json.dumps(res, indent=2, default=vars).replace('\n', '\n  ')
+        out.write('{}\n  {}: {}'.format('' if first else ',', json.dumps(distname), body))
+        out.flush()
+        first = False
+    out.write('}' if first else '\n}')
+
 @click.group()
 @click.option('--debug/--no-debug')
 def cli(debug):
@@ -59,15 +79,48 @@ class DistroImageValidation(click.Option):
 @click.option('--arch', required=False, type=click.Choice(['x86_64', 'aarch64'], case_sensitive=True), default='x86_64')
 @click.option('--image', cls=DistroImageValidation, required_if_distro=["Redhat"], multiple=True)
 @click.option('--output', type=click.Path(dir_okay=False, writable=True), help="Optional file path to write JSON output")
-def crawl(distro, version='', arch='', image='', output=None):
-    res = crawl_kernels(distro, version, arch, image)
-    json_object = json.dumps(res, indent=2, default=vars)
+@click.option('--pool-connections', type=click.IntRange(min=1), default=download.settings()['pool_connections'], show_default=True,
+              help="Number of per-host HTTP connection pools kept alive.")
+@click.option('--pool-maxsize', type=click.IntRange(min=1), default=download.settings()['pool_maxsize'], show_default=True,
+              help="Number of keep-alive connections kept in each per-host pool.")
+@click.option('--workers', type=click.IntRange(min=1), default=parallel.settings()['workers'], show_default=True,
+              help="Number of repositories of a distro crawled concurrently.")
+@click.option('--max-per-host', type=click.IntRange(min=0), default=download.settings()['max_per_host'], show_default=True,
+              help="Maximum number of concurrent requests to a single host (0 for no limit).")
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=1, show_default=True,
+              help="Number of distros crawled in parallel worker processes.")
+@click.option('--cache-dir', type=click.Path(file_okay=False, writable=True), default=download.default_cache_dir(),
+              show_default='$XDG_CACHE_HOME/kernel-crawler', help="Directory where downloaded metadata is cached across runs.")
+@click.option('--cache-size', type=click.IntRange(min=0), default=download.settings()['cache_size'] >> 20,
+              show_default=True, help="Maximum size of the cache directory, in MiB.")
+@click.option('--no-cache', is_flag=True, default=False, help="Do not use the on-disk cache.")
+@click.option('--negative-cache-ttl', type=click.IntRange(min=0), default=download.settings()['negative_ttl'],
+              show_default=True, help="Seconds during which URLs that returned 404 are not requested again (0 to disable).")
+@click.option('--hedge-percentile', type=click.IntRange(min=0, max=100), default=download.settings()['hedge_percentile'],
+              show_default=True, help="Also ask an equivalent mirror when a request takes longer than this percentile of its host latency (0 to disable).")
+@click.option('--spill-dir', type=click.Path(file_okay=False, writable=True),
+              help="Merge the Debian package lists in a temporary SQLite file under this directory instead of in memory.")
+def crawl(distro, version='', arch='', image='', output=None, pool_connections=None, pool_maxsize=None,
+          workers=None, max_per_host=None, jobs=1, cache_dir=None, cache_size=None, no_cache=False,
+          negative_cache_ttl=None, hedge_percentile=None, spill_dir=None):
+    download.configure(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_per_host=max_per_host,
+                       cache_dir=None if no_cache else cache_dir, cache_size=cache_size << 20,
+                       negative_ttl=negative_cache_ttl, hedge_percentile=hedge_percentile)
+    parallel.configure(workers=workers)
+    debstore.configure(spill_dir=spill_dir)
+    # each distro is written out as soon as it is crawled (in completion order with --jobs)
+    pairs = iter_crawl_kernels(distro, version, arch, image, jobs)
     if output:
         with open(output, 'w', encoding='utf-8') as f:
-            f.write(json_object)
-        click.echo(f"[INFO] JSON output written to {output}")
+            write_json(pairs, f)
     else:
-        click.echo(json_object)
+        write_json(pairs, sys.stdout)
+        sys.stdout.write('\n')
+    stats = download.connection_stats()
+    click.echo(f"[INFO] HTTP requests: {stats['requests']}, connections opened: {stats['connections']}, "
+               f"connections reused: {stats['reused']}", err=True)
+    if output:
+        click.echo(f"[INFO] JSON output written to {output}")
 
 cli.add_command(crawl, 'crawl')
 
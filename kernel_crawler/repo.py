@@ -14,13 +14,27 @@
 from __future__ import print_function
 from abc import ABC, abstractmethod
 
-import click
-import sys
+from kernel_crawler.utils.download import register_mirrors
+from kernel_crawler.utils.parallel import imap, progress_imap
 
 class Repository(object):
     def get_package_tree(self, version=''):
         raise NotImplementedError
 
+    def fingerprint(self, version=''):
+        '''
+        Return a cheap key identifying the contents of the repository, or None if unknown.
+        Repositories with the same fingerprint have the same package tree,
+        except for the url_prefix() of the package URLs.
+        '''
+        return None
+
+    def url_prefix(self):
+        '''
+        Return the prefix shared by the URLs of all the packages of the repository.
+        '''
+        raise NotImplementedError
+
     def __str__(self):
         raise NotImplementedError
 
@@ -46,6 +60,32 @@ def to_s(s):
     return str(s)
 
 
+def rebase_url(url, old_prefix, new_prefix):
+    '''
+    Return url with old_prefix replaced by new_prefix, or None if url is not under old_prefix.
+    '''
+    if not url.startswith(old_prefix):
+        return None
+    return new_prefix + url[len(old_prefix):]
+
+
+def dedupe_repos(repos, version=''):
+    '''
+    Return, for each repository of repos, the first repository with the same fingerprint
+    (the repository itself if there is none), so that identical repositories
+    (e.g. the same repository on several mirrors) only need to be crawled once.
+    Fingerprints may be computed concurrently.
+    '''
+    first = {}
+    originals = []
+    for repository, fingerprint in zip(repos, imap(lambda r: r.fingerprint(version), repos)):
+        if fingerprint is None:
+            originals.append(repository)
+        else:
+            originals.append(first.setdefault(fingerprint, repository))
+    return originals
+
+
 class Mirror(object):
     def __init__(self, arch):
         self.arch = arch
@@ -56,24 +96,56 @@ class Mirror(object):
     def get_package_tree(self, version=''):
         packages = {}
         repos = self.list_repos()
-        with click.progressbar(repos, label='Listing packages', file=sys.stderr, item_show_func=to_s) as repos:
-            for repo in repos:
-                for release, dependencies in repo.get_package_tree(version).items():
-                    packages.setdefault(release, set()).update(dependencies)
+        originals = dedupe_repos(repos, version)
+        crawled = [repository for repository, original in zip(repos, originals) if repository is original]
+        # repositories may be crawled concurrently, but the results are merged
+        # in the order of repos, so the outcome does not depend on the worker count
+        trees = dict(zip(map(id, crawled), progress_imap(lambda repo: repo.get_package_tree(version), crawled,
+                                                         label='Listing packages', item_show_func=to_s)))
+        for repository, original in zip(repos, originals):
+            tree = trees[id(original)]
+            if repository is not original:
+                tree = self.rebase_package_tree(tree, original.url_prefix(), repository.url_prefix())
+                if tree is None:
+                    tree = repository.get_package_tree(version)
+            for release, dependencies in tree.items():
+                packages.setdefault(release, set()).update(dependencies)
         return packages
 
+    @staticmethod
+    def rebase_package_tree(tree, old_prefix, new_prefix):
+        '''
+        Return a copy of tree with the package URLs moved from old_prefix to new_prefix,
+        or None if some of them are not under old_prefix.
+        '''
+        rebased = {}
+        for release, dependencies in tree.items():
+            urls = set()
+            for url in dependencies:
+                url = rebase_url(url, old_prefix, new_prefix)
+                if url is None:
+                    return None
+                urls.add(url)
+            rebased[release] = urls
+        return rebased
+
 
 class Distro(Mirror):
+    # groups of URL prefixes serving the same content: slow requests
+    # to one of them are hedged with the others
+    mirror_groups = []
+
     def __init__(self, mirrors, arch):
         self.mirrors = mirrors
+        for group in self.mirror_groups:
+            register_mirrors(group)
         super().__init__(arch)
 
     def list_repos(self):
         repos = []
-        with click.progressbar(
-                self.mirrors, label='Checking repositories', file=sys.stderr, item_show_func=to_s) as mirrors:
-            for mirror in mirrors:
-                repos.extend(mirror.list_repos())
+        for mirror_repos in progress_imap(lambda mirror: mirror.list_repos(), self.mirrors,
+                                          label='Checking repositories', item_show_func=to_s):
+            repos.extend(mirror_repos)
         return repos
 
 
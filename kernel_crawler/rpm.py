@@ -13,21 +13,65 @@
 
 #!/usr/bin/env python
 from __future__ import print_function
+import contextlib
+import hashlib
+import logging
+import time
 import traceback
 
 import requests
-from lxml import etree, html
+from lxml import etree
 import sqlite3
 import tempfile
+import pathlib
 import re
 import io
+import os
 
 from . import repo
-from kernel_crawler.utils.download import get_url
+from kernel_crawler.utils.download import ChecksumError, DecompressionError, cache_path, cache_stored, exists, get_url, open_url, stream_url
+from kernel_crawler.utils.listing import iter_hrefs
+from kernel_crawler.utils.parallel import imap
+from kernel_crawler.utils import memo, zchunk
+
+logger = logging.getLogger(__name__)
+
+
+def iter_primary_packages(chunks):
+    '''
+    Parse a primary.xml package listing incrementally from chunks and yield its package elements.
+    Each element is dropped once the caller is done with it, so memory usage
+    does not depend on the size of the listing.
+    '''
+    parser = etree.XMLPullParser(events=('end',), tag='{*}package')
+
+    def events():
+        for chunk in chunks:
+            parser.feed(chunk)
+            yield from parser.read_events()
+        parser.close()
+        yield from parser.read_events()
+
+    for _, package in events():
+        yield package
+        package.clear()
+        while package.getprevious() is not None:
+            del package.getparent()[0]
+
 
 class RpmRepository(repo.Repository):
+    # the repomd data types of the package list parsed by get_package_tree, by order of preference:
+    # the one with the smallest download size is used
+    repodb_types = ('primary_db', 'primary')
+
+    # the repomd data type of the zchunk compressed primary.xml, preferred over repodb_types whenever
+    # the cache is enabled: the copy kept there lets the next runs only download the chunks that changed
+    zchunk_type = 'primary_zck'
+
     def __init__(self, base_url):
         self.base_url = base_url
+        self._repomd = None
+        self._repodb_type = None
 
     def __str__(self):
         return self.base_url
@@ -62,9 +106,107 @@ class RpmRepository(repo.Repository):
             # if filtering, match anythint like 5.6.6 (version) or 5.6.6-300.fc32 (version || '-' || release)
             return base_query + ''' AND (version = ? OR version || '-' || "release" = ?)''', (filter, filter)
 
+    @classmethod
+    def open_repo_db(cls, path):
+        '''
+        Open a primary_db from the store read-only, letting SQLite memory-map the file
+        instead of reading it into its page cache. Stored databases never change,
+        so they are also opened as immutable, which skips all locking.
+        '''
+        db = sqlite3.connect('{}?mode=ro&immutable=1'.format(pathlib.Path(path).resolve().as_uri()), uri=True)
+        db.execute('PRAGMA mmap_size = {}'.format(os.path.getsize(path)))
+        return db
+
+    @classmethod
+    @contextlib.contextmanager
+    def load_repo_db(cls, repodb):
+        '''
+        Open the decompressed primary_db contents repodb as a writable database, loading them straight
+        into an in-memory database when sqlite3 supports deserialize (Python 3.11+),
+        or through a temporary file otherwise.
+        '''
+        if hasattr(sqlite3.Connection, 'deserialize'):
+            db = sqlite3.connect(':memory:')
+            try:
+                db.deserialize(repodb)
+                yield db
+            finally:
+                db.close()
+            return
+        with tempfile.NamedTemporaryFile() as tf:
+            tf.write(repodb)
+            tf.flush()
+            db = sqlite3.connect(tf.name)
+            try:
+                yield db
+            finally:
+                db.close()
+
+    # the subset of the primary_db schema used by parse_repo_db and kernel_package_query
+    PRIMARY_XML_SCHEMA = '''
+        CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, name TEXT, arch TEXT,
+                               epoch TEXT, version TEXT, release TEXT, location_href TEXT);
+        CREATE TABLE provides (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER);
+        CREATE TABLE requires (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER);
+    '''
+
+    @classmethod
+    def load_primary_xml(cls, chunks):
+        '''
+        Load the primary.xml package listing from chunks into an in-memory database
+        with the tables of a primary_db that the dependency query uses, parsing it as it is downloaded.
+        Only versioned provides and requires are kept: the query joins them on all the version columns,
+        so entries where those are NULL never match anyway.
+        '''
+        db = sqlite3.connect(':memory:')
+        db.executescript(cls.PRIMARY_XML_SCHEMA)
+        for pkgkey, package in enumerate(iter_primary_packages(chunks), 1):
+            version = package.find('{*}version')
+            location = package.find('{*}location')
+            if version is None or location is None:
+                continue
+            db.execute('INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                pkgkey, package.findtext('{*}name'), package.findtext('{*}arch'),
+                version.get('epoch'), version.get('ver'), version.get('rel'), location.get('href')))
+            for table in ('provides', 'requires'):
+                db.executemany('INSERT INTO {} VALUES (?, ?, ?, ?, ?, ?)'.format(table), [
+                    (entry.get('name'), entry.get('flags'), entry.get('epoch'), entry.get('ver'), entry.get('rel'), pkgkey)
+                    for entry in package.iterfind('{{*}}format/{{*}}{}/{{*}}entry'.format(table))
+                    if entry.get('flags') is not None
+                ])
+        db.commit()
+        return db
+
+    # indexes used by the recursive query of parse_repo_db: requires are looked up by package,
+    # and the provides matching them by all the columns of the join
+    REPODB_INDEXES = {
+        'requires_pkgkey': ('requires', ('pkgKey',)),
+        'provides_nevr': ('provides', ('name', 'flags', 'epoch', 'version', 'release')),
+    }
+
+    @classmethod
+    def index_repo_db(cls, db):
+        '''
+        Create the indexes the dependency query needs in a writable primary_db, unless there already
+        is an index starting with the same columns (createrepo only indexes provides by name,
+        so every step of the query would otherwise scan all the versions of a provided name).
+        '''
+        for index, (table, columns) in cls.REPODB_INDEXES.items():
+            prefixes = set()
+            for existing in db.execute('PRAGMA index_list("{}")'.format(table)):
+                existing_columns = [row[2].lower() for row in db.execute('PRAGMA index_info("{}")'.format(existing[1]))]
+                prefixes.add(tuple(existing_columns[:len(columns)]))
+            if tuple(column.lower() for column in columns) not in prefixes:
+                db.execute('CREATE INDEX "{}" ON "{}" ({})'.format(index, table, ', '.join(columns)))
+        db.commit()
+
     @classmethod
     def parse_repo_db(cls, repo_db, filter=''):
-        db = sqlite3.connect(repo_db)
+        # repo_db is either the path of the database or an already open connection
+        if isinstance(repo_db, sqlite3.Connection):
+            db = repo_db
+        else:
+            db = sqlite3.connect(repo_db)
         cursor = db.cursor()
 
         base_query, args = cls.build_base_query(filter)
@@ -81,33 +223,256 @@ class RpmRepository(repo.Repository):
         cursor.execute(query, args)
         return cursor.fetchall()
 
-    def get_repodb_url(self):
-        repomd = get_url(self.base_url + 'repodata/repomd.xml')
-        if not repomd:
+    def get_repomd(self):
+        '''
+        Return the contents of repomd.xml, fetching it only once per repository object.
+        '''
+        if self._repomd is None:
+            self._repomd = get_url(self.base_url + 'repodata/repomd.xml')
+        return self._repomd
+
+    def get_repomd_data(self, repodb_type, expr):
+        '''
+        Return the first match of the xpath expr relative to the repomd.xml entry of repodb_type, or None.
+        '''
+        repomd = self.get_repomd()
+        if not repomd or not repodb_type:
             return None
-        pkglist_url = self.get_loc_by_xpath(repomd, '//repo:repomd/repo:data[@type="primary_db"]/repo:location/@href')
+        return self.get_loc_by_xpath(repomd, '//repo:repomd/repo:data[@type="{}"]/{}'.format(repodb_type, expr))
+
+    def get_repodb_type(self):
+        '''
+        Return the type of the package list to parse: zchunk_type if it is advertised by repomd.xml
+        and the cache is enabled, else the advertised one of repodb_types with the smallest download size,
+        or the most preferred one if the sizes are equal or unknown.
+        Return None if none of them is advertised.
+        '''
+        if self._repodb_type is None:
+            if self.get_repomd_data(self.zchunk_type, 'repo:location/@href') and cache_path('zchunk'):
+                self._repodb_type = self.zchunk_type
+                return self._repodb_type
+            candidates = []
+            for preference, repodb_type in enumerate(self.repodb_types):
+                if not self.get_repomd_data(repodb_type, 'repo:location/@href'):
+                    continue
+                try:
+                    size = int(self.get_repomd_data(repodb_type, 'repo:size/text()'))
+                except (TypeError, ValueError):
+                    size = float('inf')
+                candidates.append((size, preference, repodb_type))
+            if not candidates:
+                return None
+            self._repodb_type = min(candidates)[2]
+        return self._repodb_type
+
+    def get_repodb_url(self):
+        pkglist_url = self.get_repomd_data(self.get_repodb_type(), 'repo:location/@href')
         if not pkglist_url:
             return None
         return self.base_url + pkglist_url
 
+    def get_repodb_checksum(self):
+        '''
+        Return the checksum of the package list as advertised by repomd.xml, or None.
+        '''
+        return self.get_repomd_data(self.get_repodb_type(), 'repo:checksum/text()')
+
+    def get_stored_repodb(self, repodb_url):
+        '''
+        Return the path of the decompressed primary_db in the checksum-addressed store under the cache dir,
+        downloading, decompressing and indexing (see index_repo_db) it there first if it is not stored yet.
+        The download is verified against the checksums advertised by repomd.xml, raising ChecksumError
+        on a mismatch (e.g. a mirror caught in the middle of a sync).
+        Return None if the cache is disabled or the database could not be stored.
+        '''
+        store = cache_path('primary_db')
+        checksum = self.get_repodb_checksum()
+        if store is None or not checksum or not re.match(r'^[0-9a-fA-F]+$', checksum):
+            return None
+        path = os.path.join(store, checksum + '-indexed.sqlite')
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+
+        repodb_type = self.get_repodb_type()
+        hasher = sha256 = None
+        if self.get_repomd_data(repodb_type, 'repo:checksum/@type') == 'sha256':
+            sha256 = checksum
+        else:
+            # check the decompressed database against its open-checksum instead
+            open_checksum = self.get_repomd_data(repodb_type, 'repo:open-checksum/text()')
+            open_checksum_type = self.get_repomd_data(repodb_type, 'repo:open-checksum/@type')
+            open_checksum_type = 'sha1' if open_checksum_type == 'sha' else open_checksum_type
+            if not open_checksum or open_checksum_type not in hashlib.algorithms_available:
+                return None
+            hasher = hashlib.new(open_checksum_type)
+        # the temporary file is created before the request, so that nothing can fail
+        # between the response being opened and its body being consumed
+        fd, tmp = tempfile.mkstemp(dir=store, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                chunks = stream_url(repodb_url, sha256=sha256)
+                if chunks is None:
+                    os.unlink(tmp)
+                    return None
+                for chunk in chunks:
+                    if hasher:
+                        hasher.update(chunk)
+                    f.write(chunk)
+            if hasher and hasher.hexdigest() != open_checksum:
+                raise ChecksumError('Checksum mismatch for {}'.format(repodb_url))
+            # stored databases are opened read-only, so they must be indexed beforehand
+            start = time.monotonic()
+            db = sqlite3.connect(tmp)
+            try:
+                self.index_repo_db(db)
+            finally:
+                db.close()
+            logger.debug('Indexed {} in {:.3f}s'.format(repodb_url, time.monotonic() - start))
+            os.replace(tmp, path)
+        except (requests.exceptions.RequestException, ChecksumError):
+            os.unlink(tmp)
+            raise
+        except Exception as e:
+            os.unlink(tmp)
+            print(f"[ERROR] Failed to store {repodb_url}: {e}")
+            return None
+        cache_stored(path)
+        return path
+
+    def url_prefix(self):
+        return self.base_url
+
+    def fingerprint(self, filter=''):
+        '''
+        Two repositories advertising the same package list checksum have the same contents.
+        '''
+        checksum = self.get_repodb_checksum()
+        if not checksum:
+            return None
+        return (type(self).__name__, self.get_repodb_type(), str(checksum), filter)
+
+    def memo_key(self, filter=''):
+        '''
+        Return (key identifying the package tree of this repository, checksum of its current contents), or None.
+        The checksum changes whenever the package list does, so a result stored with
+        the same checksum can be reused as is.
+        '''
+        checksum = self.get_repodb_checksum()
+        if not checksum:
+            return None
+        return [type(self).__name__, self.base_url, filter], str(checksum)
+
+    def query_primary_db(self, repodb_url, filter=''):
+        '''
+        Return the result of parse_repo_db on the primary_db at repodb_url, or None if it does not exist.
+        '''
+        repodb_path = self.get_stored_repodb(repodb_url)
+        if repodb_path:
+            start = time.monotonic()
+            with contextlib.closing(self.open_repo_db(repodb_path)) as db:
+                rows = self.parse_repo_db(db, filter)
+        else:
+            repodb = get_url(repodb_url)
+            if not repodb:
+                return None
+            with self.load_repo_db(repodb) as db:
+                index_start = time.monotonic()
+                self.index_repo_db(db)
+                start = time.monotonic()
+                logger.debug('Indexed {} in {:.3f}s'.format(repodb_url, start - index_start))
+                rows = self.parse_repo_db(db, filter)
+        logger.debug('Queried the dependencies of {} in {:.3f}s ({} rows)'.format(
+            repodb_url, time.monotonic() - start, len(rows)))
+        return rows
+
+    def stream_zchunk(self, repodb_url):
+        '''
+        Update the copy of the zchunk package list at repodb_url kept in the cache,
+        only downloading the chunks that changed since the previous run (see zchunk.update),
+        and return an iterator over its decompressed contents, or None if it does not exist.
+        '''
+        store = cache_path('zchunk')
+        path = os.path.join(store, hashlib.sha256(self.base_url.encode('utf-8')).hexdigest() + '.zck')
+        header_size = self.get_repomd_data(self.zchunk_type, 'repo:header-size/text()')
+        downloaded = zchunk.update(repodb_url, path,
+                                   self.get_repomd_data(self.zchunk_type, 'repo:checksum/@type'),
+                                   self.get_repodb_checksum(),
+                                   int(header_size) if header_size else None)
+        if downloaded is None:
+            return None
+        logger.debug('Downloaded {} bytes of {} ({} bytes)'.format(downloaded, repodb_url, os.path.getsize(path)))
+        cache_stored(path)
+        return zchunk.iter_decompressed(path)
+
+    def stream_primary_xml(self, repodb_url):
+        '''
+        Return an iterator over the decompressed primary.xml listing at repodb_url, or None if it does not exist.
+        If the zchunk listing cannot be updated, the plain one is used instead.
+        '''
+        if self.get_repodb_type() != self.zchunk_type:
+            return stream_url(repodb_url)
+        try:
+            return self.stream_zchunk(repodb_url)
+        except zchunk.ZchunkError as e:
+            print(f"[ERROR] Failed to update {repodb_url}: {e}")
+        primary_url = self.get_repomd_data('primary', 'repo:location/@href')
+        if not primary_url:
+            return None
+        return stream_url(self.base_url + primary_url)
+
+    def query_primary_xml(self, repodb_url, filter=''):
+        '''
+        Return the result of parse_repo_db on the primary.xml listing at repodb_url, or None if it does not exist.
+        The listing is streamed into an in-memory database (see load_primary_xml).
+        '''
+        chunks = self.stream_primary_xml(repodb_url)
+        if chunks is None:
+            return None
+        load_start = time.monotonic()
+        db = self.load_primary_xml(chunks)
+        try:
+            self.index_repo_db(db)
+            start = time.monotonic()
+            logger.debug('Loaded {} in {:.3f}s'.format(repodb_url, start - load_start))
+            rows = self.parse_repo_db(db, filter)
+        finally:
+            db.close()
+        logger.debug('Queried the dependencies of {} in {:.3f}s ({} rows)'.format(
+            repodb_url, time.monotonic() - start, len(rows)))
+        return rows
+
     def get_package_tree(self, filter=''):
         packages = {}
         try:
             repodb_url = self.get_repodb_url()
             if not repodb_url:
                 return {}
-            repodb = get_url(repodb_url)
-            if not repodb:
+            memo_key = self.memo_key(filter)
+            if memo_key:
+                cached = memo.load('rpm', *memo_key)
+                if cached is not None:
+                    return cached
+            if self.get_repodb_type() == 'primary_db':
+                rows = self.query_primary_db(repodb_url, filter)
+            else:
+                rows = self.query_primary_xml(repodb_url, filter)
+            if rows is None:
                 return {}
         except requests.exceptions.RequestException:
             traceback.print_exc()
             return {}
-        with tempfile.NamedTemporaryFile() as tf:
-            tf.write(repodb)
-            tf.flush()
-            for pkg in self.parse_repo_db(tf.name, filter):
-                version, url = pkg
-                packages.setdefault(version, set()).add(self.base_url + url)
+        except ChecksumError as e:
+            print(f"[ERROR] {e}")
+            return {}
+        except (etree.XMLSyntaxError, zchunk.ZchunkError, DecompressionError, sqlite3.Error) as e:
+            print(f"[ERROR] Malformed package listing {repodb_url}: {e}")
+            return {}
+        for pkg in rows:
+            version, url = pkg
+            packages.setdefault(version, set()).add(self.base_url + url)
+        if memo_key:
+            memo.store('rpm', *memo_key, packages)
         return packages
 
 
@@ -129,38 +494,27 @@ class RpmMirror(repo.Mirror):
 
     def dist_exists(self, dist):
         try:
-            r = requests.get(
-                self.dist_url(dist),
-                headers={  # some URLs require a user-agent, otherwise they return HTTP 406 - this one is fabricated
-                    'user-agent': 'dummy'
-                },
-                timeout = 15
-            )
-            r.raise_for_status()
+            return exists(self.dist_url(dist))
         except requests.exceptions.RequestException:
             return False
-        return True
+
+    def existing_dists(self, dists):
+        '''
+        Return the dists passing the repo filter that exist on the mirror, in their original order.
+        The existence checks may run concurrently.
+        '''
+        dists = [dist for dist in dists
+                 if dist.endswith('/')
+                 and not dist.startswith('/')
+                 and not dist.startswith('?')
+                 and not dist.startswith('http')
+                 and self.repo_filter(dist)
+                 ]
+        return [dist for dist, exists in zip(dists, imap(self.dist_exists, dists)) if exists]
 
     def list_repos(self):
-        dists = requests.get(
-            self.base_url, 
-            headers={  # some URLs require a user-agent, otherwise they return HTTP 406 - this one is fabricated
-                'user-agent': 'dummy'
-            },
-            timeout = 15
-        )
-        dists.raise_for_status()
-        dists = dists.content
-        doc = html.fromstring(dists, self.base_url)
-        dists = doc.xpath('/html/body//a[not(@href="../")]/@href')
-        return [RpmRepository(self.dist_url(dist)) for dist in dists
-                if dist.endswith('/')
-                and not dist.startswith('/')
-                and not dist.startswith('?')
-                and not dist.startswith('http')
-                and self.repo_filter(dist)
-                and self.dist_exists(dist)
-                ]
+        dists = iter_hrefs(open_url(self.base_url, missing_ok=False))
+        return [RpmRepository(self.dist_url(dist)) for dist in self.existing_dists(dists)]
 
 
 class SUSERpmMirror(RpmMirror):
@@ -183,25 +537,8 @@ class SUSERpmMirror(RpmMirror):
         '''
         Overridden from RpmMirror exchanging RpmRepository for SUSERpmRepository.
         '''
-        dists = requests.get(
-            self.base_url,
-            headers={  # some URLs require a user-agent, otherwise they return HTTP 406 - this one is fabricated
-                'user-agent': 'dummy'
-            },
-            timeout = 15
-        )
-        dists.raise_for_status()
-        dists = dists.content
-        doc = html.fromstring(dists, self.base_url)
-        dists = doc.xpath('/html/body//a[not(@href="../")]/@href')
-        ret = [SUSERpmRepository(self.dist_url(dist), self.arch) for dist in dists
-                if dist.endswith('/')
-                and not dist.startswith('/')
-                and not dist.startswith('?')
-                and not dist.startswith('http')
-                and self.repo_filter(dist)
-                and self.dist_exists(dist)
-                ]
+        dists = iter_hrefs(open_url(self.base_url, missing_ok=False))
+        ret = [SUSERpmRepository(self.dist_url(dist), self.arch) for dist in self.existing_dists(dists)]
 
         return ret
 
@@ -210,29 +547,29 @@ class SUSERpmRepository(RpmRepository):
     # the kernel headers package name pattern to search for in the package listing XML
     _kernel_devel_pattern = 'kernel-default-devel-'
 
+    # SUSE stores their primary package listing under a different path in the XML from a normal RPM repomd.
+    repodb_types = ('primary',)
+    zchunk_type = None
+
     def __init__(self, base_url, arch):
         '''
         Constructor, which sets the base URL and the arch.
         The arch is used for finding the correct package in the repomd.
         '''
-        self.base_url = base_url
+        super(SUSERpmRepository, self).__init__(base_url)
         self.arch = arch
 
-    def get_repodb_url(self):
-        '''
-        SUSE stores their primary package listing under a different path in the XML from a normal RPM repomd.
-        '''
-        repomd = get_url(self.base_url + 'repodata/repomd.xml')
-        if not repomd:
-            return None
-        pkglist_url = self.get_loc_by_xpath(repomd, '//repo:repomd/repo:data[@type="primary"]/repo:location/@href')
+    def memo_key(self, filter=''):
+        memo_key = super(SUSERpmRepository, self).memo_key(filter)
+        if memo_key:
+            memo_key[0].append(self.arch)
+        return memo_key
 
-        # if no pkglist was found, return None
-        if not pkglist_url:
-            return None
-
-        # else add the pkglist_url to the base_url
-        return self.base_url + pkglist_url
+    def fingerprint(self, filter=''):
+        fingerprint = super(SUSERpmRepository, self).fingerprint(filter)
+        if fingerprint:
+            fingerprint += (self.arch,)
+        return fingerprint
 
     def parse_kernel_release(self, kernel_devel_pkg):
         '''
@@ -254,50 +591,54 @@ class SUSERpmRepository(RpmRepository):
         '''
         return f'{self.base_url}noarch/kernel-devel-{kernel_release}.rpm'.replace(self.arch, 'noarch')
 
-    def open_repo(self, repo_path):
+    def iter_kernel_devel_hrefs(self, chunks):
+        '''
+        Parse the primary package listing incrementally from chunks (see iter_primary_packages)
+        and yield the location href of every kernel-default-devel package for the arch.
+        '''
         package_match = f'{self.arch}/{self._kernel_devel_pattern}'
-        # regex searching through a file is more memory efficient
-        # than parsing the xml into an object structure with lxml etree
-        with open(repo_path, mode='r') as f:
-            text = str(f.read())
-            search = re.search(f'.*href="({package_match}.*rpm)', text)
-            if search:
-                return search.group(1)
-            return None
-        return None
+        for package in iter_primary_packages(chunks):
+            location = package.find('{*}location')
+            href = location.get('href') if location is not None else None
+            if href and href.startswith(package_match) and href.endswith('.rpm'):
+                yield href
 
     def get_package_tree(self, filter=''):
         '''
         Build the package tree for SUSE, which finds the repomd, parses it for the primary package listing,
-        and queries for the kernel-default-devel package url. SUSE stores the primary package listing in XML.
-        Once parsed, use the package URL to parse the kernel release and determine the kernel-devel*noarch package URL.
+        and queries for the kernel-default-devel package urls. SUSE stores the primary package listing in XML,
+        which is parsed while it is being downloaded.
+        Use each package URL to parse the kernel release and determine the kernel-devel*noarch package URL.
         '''
 
-
         # attempt to query for the repomd - bail out if 404
         try:
             repodb_url = self.get_repodb_url()
-            repodb = get_url(repodb_url)
-            if not repodb:
+            if not repodb_url:
                 return {}
+            memo_key = self.memo_key(filter)
+            if memo_key:
+                cached = memo.load('rpm', *memo_key)
+                if cached is not None:
+                    return cached
         except requests.exceptions.RequestException:
             # traceback.print_exc()  # extremely verbose, uncomment if debugging
             return {}
 
-        # write the repodb xml to a tempfile for parsing
-        with tempfile.NamedTemporaryFile() as tf:
-            tf.write(repodb)
-            tf.flush()
-            kernel_default_devel_pkg_url = self.open_repo(tf.name)
-            tf.close()  # delete the tempfile to free up memory
-
-        # check to ensure a kernel_devel_pkg was found
-        if not kernel_default_devel_pkg_url:
-            return {}  # return an empty packages dict
-
-        else:  # was able to find some packages
-            packages = {}
+        try:
+            chunks = stream_url(repodb_url)
+            if chunks is None:
+                return {}
+            kernel_default_devel_pkg_urls = list(self.iter_kernel_devel_hrefs(chunks))
+        except requests.exceptions.RequestException as e:
+            print(f"[ERROR] Request failed for {repodb_url}: {e}")
+            return {}
+        except (etree.XMLSyntaxError, DecompressionError) as e:
+            print(f"[ERROR] Malformed package listing {repodb_url}: {e}")
+            return {}
 
+        packages = {}
+        for kernel_default_devel_pkg_url in kernel_default_devel_pkg_urls:
             # parse out the kernel release from the url, faster than re-parsing the xml
             parsed_kernel_release = self.parse_kernel_release(kernel_default_devel_pkg_url)
 
@@ -309,4 +650,6 @@ class SUSERpmRepository(RpmRepository):
             noarch_kernel_devel = self.build_kernel_devel_noarch_url(parsed_kernel_release)
             packages.setdefault(parsed_kernel_release, set()).add(noarch_kernel_devel)
 
-            return packages
+        if memo_key:
+            memo.store('rpm', *memo_key, packages)
+        return packages
@@ -3,12 +3,23 @@ import zlib
 import zstandard
 import requests
 import io
+import os
+import json
+import math
+import queue
+import hashlib
+import tempfile
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
 
 try:
     import lzma
 except ImportError:
     from backports import lzma
 
+from requests.adapters import HTTPAdapter
 from requests.exceptions import (
     ConnectTimeout,
     ReadTimeout,
@@ -17,35 +28,975 @@ from requests.exceptions import (
     RequestException,
 )
 
+# Transport settings, see configure().
+#  - pool_connections: how many per-host connection pools are kept around
+#  - pool_maxsize: how many keep-alive connections are kept in each pool
+#  - max_per_host: how many requests may be in flight to a single host (0 means no limit)
+#  - cache_dir: where responses are cached across runs (None disables the cache)
+#  - cache_size: how many bytes the whole cache dir may take
+#  - negative_ttl: for how many seconds a URL that returned 404 is assumed to still be missing
+#  - hedge_percentile: a request to a mirror that has not answered within this percentile
+#    of its observed latency is also sent to an equivalent mirror (0 disables hedging)
+_settings = {
+    'pool_connections': 32,
+    'pool_maxsize': 16,
+    'max_per_host': 4,
+    'cache_dir': None,
+    'cache_size': 2 << 30,
+    'negative_ttl': 24 * 3600,
+    'hedge_percentile': 95,
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+# connection/request counters of the pools that were already evicted or closed
+_retired = {'connections': 0, 'requests': 0}
+_retired_lock = threading.Lock()
+
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+# estimated size of the cache dir (None until it is first scanned), see cache_stored()
+_cache_usage = None
+_cache_usage_lock = threading.Lock()
+# eviction goes down to this fraction of cache_size, so that it does not run again on the next write
+_EVICTION_LOW_WATER = 0.9
+
+# groups of URL prefixes serving the same content, see register_mirrors()
+_mirror_groups = []
+_mirror_groups_lock = threading.Lock()
+
+# recent time-to-headers samples of every host, used to decide when to hedge a request
+_HEDGE_MIN_SAMPLES = 10
+_latencies = {}
+_latencies_lock = threading.Lock()
+
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'kernel-crawler')
+
+
+def configure(**kwargs):
+    '''
+    Update the transport settings. Any existing session is closed,
+    so that the next request picks up the new settings.
+    '''
+    unknown = set(kwargs) - set(_settings)
+    if unknown:
+        raise TypeError('Unknown download settings: {}'.format(', '.join(sorted(unknown))))
+    _settings.update(kwargs)
+    reset()
+
+
+def settings():
+    return dict(_settings)
+
+
+class _PoolAdapter(HTTPAdapter):
+    '''
+    HTTPAdapter keeping track of the connections opened by the pools it evicts,
+    so that connection_stats() covers the whole run.
+    '''
+    def init_poolmanager(self, *args, **kwargs):
+        super(_PoolAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pools.dispose_func = _retire_pool
+
+
+def _retire_pool(pool):
+    with _retired_lock:
+        _retired['connections'] += pool.num_connections
+        _retired['requests'] += pool.num_requests
+    pool.close()
+
+
+def get_session():
+    '''
+    Return the requests session shared by every crawler, creating it on first use.
+    '''
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # some URLs require a user-agent, otherwise they return HTTP 406 - this one is fabricated
+            session.headers['user-agent'] = 'dummy'
+            adapter = _PoolAdapter(
+                pool_connections=_settings['pool_connections'],
+                pool_maxsize=_settings['pool_maxsize'],
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def reset():
+    '''
+    Close the shared session (if any). This must also be called in forked
+    processes, which must not reuse the sockets of their parent.
+    '''
+    global _session, _cache_usage
+    with _session_lock:
+        session, _session = _session, None
+    with _host_slots_lock:
+        _host_slots.clear()
+    with _cache_usage_lock:
+        # the cache dir may have changed
+        _cache_usage = None
+    if session is not None:
+        session.close()
+
+
+def connection_stats():
+    '''
+    Return how many connections were opened and how many requests were sent
+    over them. Every request above the number of connections reused a keep-alive connection.
+    '''
+    with _retired_lock:
+        stats = dict(_retired)
+    session = _session
+    if session is not None:
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    stats['connections'] += pool.num_connections
+                    stats['requests'] += pool.num_requests
+    stats['reused'] = max(stats['requests'] - stats['connections'], 0)
+    return stats
+
+
+def add_connection_stats(stats):
+    '''
+    Account for connections and requests made elsewhere, e.g. by worker processes.
+    '''
+    with _retired_lock:
+        _retired['connections'] += stats['connections']
+        _retired['requests'] += stats['requests']
+
+
+class _Unlimited(object):
+    def acquire(self):
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def host_slot(url):
+    '''
+    Return a context manager bounding the number of concurrent requests to the host of url.
+    '''
+    limit = _settings['max_per_host']
+    if not limit:
+        return _Unlimited()
+    host = urlsplit(url).netloc
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(limit)
+    return slot
+
+
+def register_mirrors(prefixes):
+    '''
+    Declare that the URL prefixes serve the same content, so that requests
+    under any of them may be hedged with the others.
+    '''
+    group = tuple(prefixes)
+    with _mirror_groups_lock:
+        if group not in _mirror_groups:
+            _mirror_groups.append(group)
+
+
+def mirror_alternates(url):
+    '''
+    Return the URLs serving the same content as url on the mirrors equivalent to its own.
+    '''
+    with _mirror_groups_lock:
+        groups = list(_mirror_groups)
+    for group in groups:
+        for prefix in group:
+            if url.startswith(prefix):
+                return [other + url[len(prefix):] for other in group if other != prefix]
+    return []
+
+
+def _record_latency(url, seconds):
+    host = urlsplit(url).netloc
+    with _latencies_lock:
+        samples = _latencies.get(host)
+        if samples is None:
+            samples = _latencies[host] = deque(maxlen=100)
+        samples.append(seconds)
+
+
+def _hedge_delay(url):
+    '''
+    Return how long to wait for url to answer before racing an equivalent mirror,
+    or None if there are not enough latency samples of its host yet.
+    '''
+    percentile = _settings['hedge_percentile']
+    if not percentile:
+        return None
+    with _latencies_lock:
+        samples = sorted(_latencies.get(urlsplit(url).netloc, ()))
+    if len(samples) < _HEDGE_MIN_SAMPLES:
+        return None
+    return samples[max(0, math.ceil(len(samples) * percentile / 100) - 1)]
+
+
+def _send(url, headers):
+    '''
+    Send a streaming GET request, returning the response as soon as its headers are in,
+    along with the host slot, which is held until the caller releases it.
+    '''
+    slot = host_slot(url)
+    slot.acquire()
+    try:
+        start = time.monotonic()
+        resp = get_session().get(url, headers=headers, stream=True, timeout=15)
+        _record_latency(url, time.monotonic() - start)
+    except BaseException:
+        slot.release()
+        raise
+    return resp, slot
+
+
+def _discard(resp, slot):
+    resp.close()
+    slot.release()
+
+
+class _Race(object):
+    '''
+    The same request sent to several equivalent mirrors. Responses arriving
+    after the race is over are closed as soon as they come in.
+    '''
+    def __init__(self):
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.over = False
+
+    def start(self, url, headers):
+        self.running += 1
+        threading.Thread(target=self._run, args=(url, headers), daemon=True).start()
+
+    def _run(self, url, headers):
+        try:
+            result = url, _send(url, headers), None
+        except Exception as exc:
+            result = url, None, exc
+        with self.lock:
+            if not self.over:
+                self.results.put(result)
+                return
+        if result[1] is not None:
+            _discard(*result[1])
+
+    def finish(self):
+        with self.lock:
+            self.over = True
+        while True:
+            try:
+                _, sent, _ = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if sent is not None:
+                _discard(*sent)
+
+
+_CONDITIONAL_HEADERS = ('if-none-match', 'if-modified-since', 'if-match', 'if-unmodified-since', 'if-range')
+
+
+def open_response(url, headers=None):
+    '''
+    Send a GET request for url and return (response, slot) as soon as the response headers are in.
+    The body is not read yet and the host slot is held: the caller must close the response
+    and release the slot.
+
+    If url has equivalent mirrors (see register_mirrors()) and its host does not answer within
+    the hedge_percentile of its usual latency, the request is sent to the next mirror as well,
+    and whichever answers first wins. A mirror failing outright is replaced at once.
+    Only the primary host is trusted to report a missing file: an error status (e.g. a 404
+    from a mirror that is not a full copy) counts as a failure of that mirror.
+    Mirrors get no conditional headers, as validators are specific to the server that issued them,
+    and a response from a mirror has its from_mirror attribute set, see _HttpCache.writer().
+    '''
+    headers = headers or {}
+    alternates = mirror_alternates(url)
+    delay = _hedge_delay(url) if alternates else None
+    if delay is None:
+        return _send(url, headers)
+
+    alternate_headers = {k: v for k, v in headers.items() if k.lower() not in _CONDITIONAL_HEADERS}
+    urls = iter(alternates)
+    race = _Race()
+    race.start(url, headers)
+    failure = None
+    try:
+        while race.running:
+            try:
+                sent_url, sent, exc = race.results.get(timeout=delay)
+            except queue.Empty:
+                alternate = next(urls, None)
+                if alternate is not None:
+                    race.start(alternate, alternate_headers)
+                continue
+            race.running -= 1
+            if sent is not None:
+                status = sent[0].status_code
+                if status < 300 or (sent_url == url and status < 500):
+                    if failure and failure[0] is not None:
+                        _discard(*failure[0])
+                    sent[0].from_mirror = sent_url != url
+                    return sent
+            if sent_url == url:
+                # keep the failure of the primary around in case no mirror does better
+                failure = sent, exc
+            elif sent is not None:
+                _discard(*sent)
+            alternate = next(urls, None)
+            if alternate is not None:
+                race.start(alternate, alternate_headers)
+    finally:
+        race.finish()
+    sent, exc = failure
+    if exc is not None:
+        raise exc
+    return sent
+
+
+def http_get(url, headers=None):
+    '''
+    requests.get() replacement going through the shared session, see open_response().
+    '''
+    resp, slot = open_response(url, headers)
+    try:
+        # read the body while holding the slot
+        resp.content
+    finally:
+        _discard(resp, slot)
+    return resp
+
+
+def cache_path(*names):
+    '''
+    Return the path of a directory inside the cache dir, creating it if needed,
+    or None if caching is disabled.
+    '''
+    if not _settings['cache_dir']:
+        return None
+    path = os.path.join(_settings['cache_dir'], *names)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_atomic(path, data):
+    '''
+    Write data to path through a temporary file, so that concurrent readers
+    (threads or other crawler processes) never see a partially written file.
+    '''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class _HttpCache(object):
+    '''
+    On-disk cache of response bodies along with their validators (ETag/Last-Modified).
+    Each URL is stored as <sha256(url)> (the body) and <sha256(url)>.json (the metadata).
+    The least recently used entries are evicted once the cache dir grows above cache_size.
+    '''
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        body = os.path.join(self.directory, key)
+        return body, body + '.json'
+
+    def lookup(self, url):
+        '''
+        Return (metadata, body path) for url, or None on a cache miss.
+        '''
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get('url') != url or os.path.getsize(body_path) != meta.get('size'):
+                return None
+        except (OSError, ValueError):
+            return None
+        return meta, body_path
+
+    def read(self, body_path):
+        with open(body_path, 'rb') as f:
+            content = f.read()
+        self.touch(body_path)
+        return content
+
+    def touch(self, body_path):
+        try:
+            os.utime(body_path)
+        except OSError:
+            pass
+
+    def discard(self, url):
+        for path in self._paths(url):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def writer(self, url, resp, verified=False):
+        '''
+        Return a _CacheWriter for the body of resp, or None if it cannot be cached.
+        A verified body (see open_url()) is worth keeping even if it cannot be revalidated.
+        The validators of a response from a mirror of url (see open_response()) would not match
+        those of url itself, so they are not kept.
+        '''
+        etag = last_modified = None
+        if not getattr(resp, 'from_mirror', False):
+            etag = resp.headers.get('etag')
+            last_modified = resp.headers.get('last-modified')
+        if not etag and not last_modified and not verified:
+            # cannot be revalidated, so there is no point keeping it
+            return None
+        return _CacheWriter(self, url, {'url': url, 'etag': etag, 'last_modified': last_modified})
+
+    def store(self, url, resp, content):
+        try:
+            writer = self.writer(url, resp)
+        except OSError:
+            return
+        if writer is not None:
+            try:
+                writer.write(content)
+                writer.commit()
+            except OSError:
+                writer.abort()
+
+class _CacheWriter(object):
+    '''
+    Write a response body into the cache as it is downloaded.
+    The entry only becomes visible on commit(), i.e. once the whole body was received.
+    '''
+
+    def __init__(self, cache, url, meta):
+        self.cache = cache
+        self.url = url
+        self.meta = meta
+        self.size = 0
+        fd, self.tmp = tempfile.mkstemp(dir=cache.directory, prefix='.tmp-')
+        self.f = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size <= self.cache.max_size:
+            self.f.write(data)
+
+    def commit(self):
+        self.f.close()
+        if self.size > self.cache.max_size:
+            self.abort()
+            return
+        body_path, meta_path = self.cache._paths(self.url)
+        os.replace(self.tmp, body_path)
+        self.meta['size'] = self.size
+        write_atomic(meta_path, json.dumps(self.meta).encode('utf-8'))
+        cache_stored(body_path, meta_path)
+
+    def abort(self):
+        self.f.close()
+        try:
+            os.unlink(self.tmp)
+        except OSError:
+            pass
+
+
+def _cache_entries(root):
+    # (mtime, size, paths) of every entry under root, <file>.json being the metadata of <file> if both exist
+    files = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if name.startswith('.tmp-'):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files[path] = (st.st_mtime, st.st_size)
+    entries = []
+    for path, (mtime, size) in files.items():
+        if path.endswith('.json') and path[:-len('.json')] in files:
+            continue
+        paths = [path]
+        meta = files.get(path + '.json')
+        if meta is not None:
+            size += meta[1]
+            paths.append(path + '.json')
+        entries.append((mtime, size, paths))
+    return entries
+
+
+def _evict(root, keep=()):
+    # remove the least recently used entries of the cache dir (but those of keep) until it fits in cache_size,
+    # readers are expected to touch the files they use. Called with _cache_usage_lock held
+    global _cache_usage
+    entries = sorted(_cache_entries(root))
+    total = sum(size for _, size, _ in entries)
+    if total > _settings['cache_size']:
+        target = _settings['cache_size'] * _EVICTION_LOW_WATER
+        for _, size, paths in entries:
+            if total <= target:
+                break
+            if paths[0] in keep:
+                continue
+            for victim in paths:
+                try:
+                    os.unlink(victim)
+                except OSError:
+                    pass
+            total -= size
+    _cache_usage = total
+
+
+def cache_stored(*paths):
+    '''
+    Account for files just written into the cache dir. The cache dir is only scanned on first use
+    and once its estimated size goes above cache_size, to evict the least recently used entries
+    (except the ones of paths, which the caller is about to use).
+    '''
+    global _cache_usage
+    root = _settings['cache_dir']
+    if not root:
+        return
+    size = 0
+    for path in paths:
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    with _cache_usage_lock:
+        if _cache_usage is None:
+            # the scan already covers paths
+            _evict(root, paths)
+            return
+        _cache_usage += size
+        if _cache_usage > _settings['cache_size']:
+            _evict(root, paths)
+
+
+def http_cache():
+    directory = cache_path('http')
+    if directory is None:
+        return None
+    return _HttpCache(directory, _settings['cache_size'])
+
+
+def _negative_path(url):
+    directory = cache_path('negative')
+    if directory is None or not _settings['negative_ttl']:
+        return None
+    return os.path.join(directory, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+
+def known_missing(url):
+    '''
+    Return True if url returned 404 less than negative_ttl seconds ago (possibly in an earlier run).
+    '''
+    path = _negative_path(url)
+    if path is None:
+        return False
+    try:
+        with open(path, 'rb') as f:
+            if f.read() != url.encode('utf-8'):
+                return False
+        if time.time() - os.path.getmtime(path) < _settings['negative_ttl']:
+            return True
+        os.unlink(path)
+    except OSError:
+        pass
+    return False
+
+
+def remember_missing(url):
+    path = _negative_path(url)
+    if path is not None:
+        write_atomic(path, url.encode('utf-8'))
+        cache_stored(path)
+
+
+def _missing_error(url):
+    resp = requests.Response()
+    resp.status_code = 404
+    resp.reason = 'Not Found (cached)'
+    resp.url = url
+    return requests.HTTPError('404 Client Error: Not Found (cached) for url: {}'.format(url), response=resp)
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def file_sha256(path):
+    '''
+    Return the sha256 hex digest of the file at path, reading it in chunks.
+    '''
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _verify_chunks(chunks, sha256, url, cache):
+    hasher = hashlib.sha256()
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+    if hasher.hexdigest() != sha256:
+        if cache:
+            cache.discard(url)
+        raise ChecksumError('Checksum mismatch for {}'.format(url))
+
+
+def _conditional_headers(cached):
+    headers = {}
+    if cached:
+        meta, _ = cached
+        if meta.get('etag'):
+            headers['if-none-match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['if-modified-since'] = meta['last_modified']
+    return headers
+
+
+def exists(url):
+    '''
+    Return whether url exists, using a HEAD request instead of downloading it.
+    Missing URLs are remembered in the negative cache. HTTP errors other than 404 raise requests.HTTPError.
+    '''
+    if known_missing(url):
+        return False
+    with host_slot(url):
+        resp = get_session().head(url, allow_redirects=True, timeout=15)
+        if resp.status_code in (405, 501):
+            # the server does not support HEAD
+            resp = get_session().get(url, stream=True, timeout=15)
+            resp.close()
+    if resp.status_code == 404:
+        remember_missing(url)
+        return False
+    resp.raise_for_status()
+    return True
+
+
+def fetch(url, missing_ok=True):
+    '''
+    Return the raw (still compressed) body of url.
+    A missing URL (HTTP 404) returns None, or raises requests.HTTPError if missing_ok is False;
+    any other HTTP error raises requests.HTTPError.
+
+    If a cache dir is configured, responses are cached and later revalidated
+    with a conditional request, which usually only costs a 304 response.
+    URLs that recently returned 404 are not requested again at all.
+    '''
+    if known_missing(url):
+        if missing_ok:
+            return None
+        raise _missing_error(url)
+
+    cache = http_cache()
+    cached = cache.lookup(url) if cache else None
+    resp = http_get(url, headers=_conditional_headers(cached))
+    if cached and resp.status_code == 304:
+        _, body_path = cached
+        try:
+            return cache.read(body_path)
+        except OSError:
+            # evicted in the meantime (e.g. by another crawler process)
+            resp = http_get(url)
+    if resp.status_code == 404:
+        remember_missing(url)
+        if missing_ok:
+            return None
+    resp.raise_for_status()
+
+    if cache:
+        cache.store(url, resp, resp.content)
+    return resp.content
+
+
+def fetch_ranges(url, ranges):
+    '''
+    Return the contents of the byte ranges [start, stop) of url, fetched with one HTTP range request each
+    (bypassing the cache), or None if the server does not honour range requests.
+    Any HTTP error raises requests.HTTPError.
+    '''
+    contents = []
+    for start, stop in ranges:
+        resp, slot = open_response(url, {'Range': 'bytes={}-{}'.format(start, stop - 1)})
+        try:
+            if resp.status_code != 206:
+                # most likely the whole file: do not read it
+                resp.raise_for_status()
+                return None
+            content = resp.content
+        finally:
+            _discard(resp, slot)
+        if len(content) != stop - start:
+            return None
+        contents.append(content)
+    return contents
+
+
+_CHUNK_SIZE = 1 << 16
+
+
+def _iter_file(f):
+    with f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            yield chunk
+
+
+class _ResponseBody(object):
+    '''
+    Iterator over the chunks of a streamed response body, saving it with writer (if any) as it is read.
+    The response is closed and its host slot released once the body is consumed, on error, on close(),
+    or as soon as the iterator is dropped, even if it was never iterated.
+    A failure to write into the cache only stops caching the body.
+    '''
+
+    def __init__(self, resp, slot, writer):
+        self.resp = resp
+        self.slot = slot
+        self.writer = writer
+        self.chunks = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.resp is None:
+            raise StopIteration
+        try:
+            if self.chunks is None:
+                self.chunks = self.resp.iter_content(_CHUNK_SIZE)
+            chunk = next(self.chunks)
+        except StopIteration:
+            self._write(self.writer.commit if self.writer else None)
+            self.writer = None
+            self.close()
+            raise
+        except BaseException:
+            self.close()
+            raise
+        if self.writer is not None:
+            self._write(self.writer.write, chunk)
+        return chunk
+
+    def _write(self, method, *args):
+        if method is None:
+            return
+        try:
+            method(*args)
+        except OSError:
+            # e.g. the disk is full
+            self.writer.abort()
+            self.writer = None
+
+    def close(self):
+        if self.resp is None:
+            return
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+        resp, self.resp = self.resp, None
+        _discard(resp, self.slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+def open_url(url, missing_ok=True, sha256=None):
+    '''
+    Streaming variant of fetch(): return an iterator over the chunks of the raw body of url,
+    without ever holding the whole body in memory, or None if it does not exist.
+    The body is saved into the cache while it is being read.
+
+    If the sha256 of the body is known in advance (e.g. from a signed index), a matching cached copy
+    is used without even revalidating it, and the body is verified as it is read:
+    the iterator raises ChecksumError at the end of a mismatching body.
+    '''
+    if known_missing(url):
+        if missing_ok:
+            return None
+        raise _missing_error(url)
+
+    cache = http_cache()
+    cached = cache.lookup(url) if cache else None
+    if cached and sha256:
+        _, body_path = cached
+        try:
+            if file_sha256(body_path) == sha256:
+                f = open(body_path, 'rb')
+                cache.touch(body_path)
+                return _iter_file(f)
+        except OSError:
+            pass
+    headers = _conditional_headers(cached)
+
+    # the slot is held until the body is consumed
+    resp, slot = open_response(url, headers)
+    if cached and resp.status_code == 304:
+        _discard(resp, slot)
+        _, body_path = cached
+        try:
+            f = open(body_path, 'rb')
+            cache.touch(body_path)
+            chunks = _iter_file(f)
+            return _verify_chunks(chunks, sha256, url, cache) if sha256 else chunks
+        except OSError:
+            # evicted in the meantime (e.g. by another crawler process)
+            resp, slot = open_response(url)
+    try:
+        if resp.status_code == 404:
+            remember_missing(url)
+            if missing_ok:
+                _discard(resp, slot)
+                return None
+        resp.raise_for_status()
+        writer = None
+        if cache:
+            try:
+                writer = cache.writer(url, resp, sha256 is not None)
+            except OSError:
+                # the body can still be read, just not cached
+                pass
+    except BaseException:
+        _discard(resp, slot)
+        raise
+
+    chunks = _ResponseBody(resp, slot, writer)
+    return _verify_chunks(chunks, sha256, url, cache) if sha256 else chunks
+
+
+def decompressor(url):
+    '''
+    Return an incremental decompressor for the extension of url, or None if it is not compressed.
+    '''
+    if url.endswith('.gz'):
+        return zlib.decompressobj(47)
+    elif url.endswith('.xz'):
+        return lzma.LZMADecompressor()
+    elif url.endswith('.bz2'):
+        return bz2.BZ2Decompressor()
+    elif url.endswith('.zst'):
+        return zstandard.ZstdDecompressor().decompressobj()
+    else:
+        return None
+
+
+class DecompressionError(Exception):
+    pass
+
+
+# the bz2 module reports invalid data as OSError
+_DECOMPRESSION_ERRORS = (zlib.error, lzma.LZMAError, EOFError, OSError, zstandard.ZstdError)
+
+
+def _decompress_chunks(decompressor, chunks, url):
+    flush = getattr(decompressor, 'flush', None)
+    for chunk in chunks:
+        try:
+            chunk = decompressor.decompress(chunk)
+        except _DECOMPRESSION_ERRORS as e:
+            raise DecompressionError('Failed to decompress {}: {}'.format(url, e))
+        if chunk:
+            yield chunk
+    if flush is not None:
+        try:
+            chunk = flush()
+        except _DECOMPRESSION_ERRORS as e:
+            raise DecompressionError('Failed to decompress {}: {}'.format(url, e))
+        if chunk:
+            yield chunk
+    if not getattr(decompressor, 'eof', True):
+        raise DecompressionError('Truncated compressed stream {}'.format(url))
+
+
+def stream_url(url, missing_ok=True, sha256=None, name=None):
+    '''
+    Return an iterator over the (eventually decompressed) contents of url, in chunks,
+    or None if it does not exist. Decompression happens incrementally as the body
+    is downloaded, so memory usage does not depend on the size of the file.
+    The compression is guessed from name, which defaults to url (e.g. content-addressed URLs
+    have no extension), and sha256 is the expected digest of the raw body, see open_url().
+
+    Unlike get_url(), errors (including those happening mid-stream) are raised to the caller,
+    corrupt or truncated compressed data as DecompressionError.
+    '''
+    chunks = open_url(url, missing_ok, sha256)
+    if chunks is None:
+        return None
+    d = decompressor(name or url)
+    if d is None:
+        return chunks
+    return _decompress_chunks(d, chunks, url)
+
+
+def decompress(url, content):
+    '''
+    Decompress content according to the extension of url.
+    '''
+    if url.endswith('.gz'):
+        return zlib.decompress(content, 47)
+    elif url.endswith('.xz'):
+        return lzma.decompress(content)
+    elif url.endswith('.bz2'):
+        return bz2.decompress(content)
+    elif url.endswith('.zst'):
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(content)) as rr:
+            return rr.read()
+    else:
+        return content
+
 
 def get_url(url):
     try:
-        resp = requests.get(
-            url,
-            headers={  # some URLs require a user-agent, otherwise they return HTTP 406 - this one is fabricated
-                'user-agent': 'dummy'
-            },
-            timeout=15,
-        )
+        content = fetch(url)
 
         # if 404, silently fail
-        if resp.status_code == 404:
+        if content is None:
             return None
-        else:  # if any other error, raise the error - might be a bug in crawler
-            resp.raise_for_status()
 
         # if no error, return the (eventually decompressed) contents
-        if url.endswith('.gz'):
-            return zlib.decompress(resp.content, 47)
-        elif url.endswith('.xz'):
-            return lzma.decompress(resp.content)
-        elif url.endswith('.bz2'):
-            return bz2.decompress(resp.content)
-        elif url.endswith('.zst'):
-            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(resp.content)) as rr:
-                return rr.read()
-        else:
-            return resp.content
+        return decompress(url, content)
 
     except (ConnectTimeout, ReadTimeout, Timeout):
         print(f"[ERROR] Timeout fetching {url}")
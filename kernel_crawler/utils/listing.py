@@ -0,0 +1,38 @@
+import re
+from html import unescape
+
+# the href attribute of an anchor start tag, with a double quoted, single quoted or unquoted value
+_HREF = re.compile(rb'''<a\s[^>]*?\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+
+
+def _scan(data):
+    for match in _HREF.finditer(data):
+        href = match.group(1)
+        if href is None:
+            href = match.group(2) if match.group(2) is not None else match.group(3)
+        href = unescape(href.decode('utf-8', 'replace'))
+        if href != '../':
+            yield href
+
+
+def iter_hrefs(chunks):
+    '''
+    Yield the link targets of an HTML page (e.g. a directory listing) in document order,
+    except the link to the parent directory, with character references decoded.
+    chunks is the raw page, as an iterable of byte chunks (e.g. from open_url()).
+
+    Listings can hold thousands of links, so no document tree is built:
+    a single regex pass picks the anchors out of the raw bytes as they arrive.
+    '''
+    tail = b''
+    for chunk in chunks:
+        data = tail + chunk
+        # hold back a tag cut in the middle by the end of the chunk
+        start = data.rfind(b'<')
+        if start != -1 and data.find(b'>', start) == -1:
+            data, tail = data[:start], data[start:]
+        else:
+            tail = b''
+        yield from _scan(data)
+    if tail:
+        yield from _scan(tail)
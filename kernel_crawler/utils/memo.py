@@ -0,0 +1,55 @@
+import os
+import json
+import hashlib
+
+from kernel_crawler.utils.download import cache_path, cache_stored, write_atomic
+
+# bump this whenever the format or the meaning of the memoized results changes
+_VERSION = 2
+
+
+def _path(namespace, key):
+    directory = cache_path('results', namespace)
+    if directory is None:
+        return None
+    key = json.dumps([_VERSION, key])
+    return os.path.join(directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json'), key
+
+
+def load(namespace, key, checksum):
+    '''
+    Return the package tree ({release: set of urls}) stored for the repository identified by key,
+    or None if there is none, it was built from other contents than checksum identifies
+    (or caching is disabled).
+    '''
+    path = _path(namespace, key)
+    if path is None:
+        return None
+    path, key = path
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get('key') != key or entry.get('checksum') != checksum:
+        return None
+    return {release: set(urls) for release, urls in entry['packages'].items()}
+
+
+def store(namespace, key, checksum, packages):
+    '''
+    Store a package tree ({release: set of urls}) for the repository identified by key,
+    replacing any previous one. key must be JSON-serializable and checksum must identify
+    the exact repository contents the tree was built from.
+    '''
+    path = _path(namespace, key)
+    if path is None:
+        return
+    path, key = path
+    entry = {
+        'key': key,
+        'checksum': checksum,
+        'packages': {release: sorted(urls) for release, urls in packages.items()},
+    }
+    write_atomic(path, json.dumps(entry).encode('utf-8'))
+    cache_stored(path)
@@ -0,0 +1,68 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+import click
+
+# Concurrency settings, see configure().
+#  - workers: how many repositories/mirrors of a single distro are crawled at once
+_settings = {
+    'workers': 1,
+}
+
+
+def configure(**kwargs):
+    unknown = set(kwargs) - set(_settings)
+    if unknown:
+        raise TypeError('Unknown parallel settings: {}'.format(', '.join(sorted(unknown))))
+    _settings.update(kwargs)
+
+
+def settings():
+    return dict(_settings)
+
+
+def imap(func, items):
+    '''
+    Like map(func, items), but with up to `workers` calls running concurrently.
+    Results are always yielded in the order of items, so callers merging them
+    get exactly the same result as with a serial loop.
+    '''
+    items = list(items)
+    workers = min(_settings['workers'], len(items))
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        it = iter(items)
+        # keep a bounded window of calls in flight, so that results
+        # do not pile up in memory behind a slow item
+        for item in it:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for item in it:
+                pending.append(executor.submit(func, item))
+                break
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def progress_imap(func, items, label, item_show_func=None):
+    '''
+    imap() with a click progress bar on stderr, advanced as results come in.
+    '''
+    items = list(items)
+    with click.progressbar(length=len(items), label=label, file=sys.stderr, item_show_func=item_show_func) as bar:
+        for item, result in zip(items, imap(func, items)):
+            bar.update(1, item)
+            yield result
@@ -0,0 +1,88 @@
+import re
+
+from kernel_crawler.utils.py23 import make_string
+
+# Debian archives publish, next to each Packages file, a Packages.diff/Index listing ed scripts ("pdiffs")
+# turning its previous versions into the current one (https://wiki.debian.org/DebianRepository/Format),
+# so that a client holding an older copy only needs to download the changes.
+
+_COMMAND = re.compile(rb'^(\d+)(?:,(\d+))?([acd])$')
+
+
+class PdiffError(Exception):
+    pass
+
+
+class PdiffIndex(object):
+    '''
+    Parsed Packages.diff/Index file.
+    '''
+
+    def __init__(self, content):
+        fields = {}
+        field = None
+        for line in make_string(content).splitlines():
+            if line.startswith(' '):
+                if field is not None:
+                    fields[field].append(line.split())
+                continue
+            try:
+                field, value = line.split(':', 1)
+            except ValueError:
+                field = None
+                continue
+            fields[field] = [value.split()] if value.strip() else []
+
+        # sha256 and size of the current Packages file
+        current = fields.get('SHA256-Current', [[]])[0]
+        self.current = (current[0], int(current[1])) if len(current) == 2 else None
+        # [(sha256 of a previous Packages file, patch name)], oldest first
+        self.history = [(entry[0], entry[2]) for entry in fields.get('SHA256-History', []) if len(entry) == 3]
+        # patch name -> sha256 of the uncompressed patch
+        self.patches = {entry[2]: entry[0] for entry in fields.get('SHA256-Patches', []) if len(entry) == 3}
+        # with merged patches, each patch leads from its previous version straight to the current one
+        precedence = fields.get('X-Patch-Precedence', [[]])
+        self.merged = precedence == [['merged']]
+
+    def patches_from(self, sha256):
+        '''
+        Return the names of the patches to apply, in order, to the previous Packages file with digest sha256,
+        or None if it is not in the history.
+        '''
+        for i, (digest, name) in enumerate(self.history):
+            if digest == sha256:
+                return [name] if self.merged else [name for _, name in self.history[i:]]
+        return None
+
+
+def apply(lines, patch):
+    '''
+    Apply the ed script patch (as produced by diff --ed) to lines, a list of lines
+    including their line endings, in place. The commands of such a script go from
+    the end of the file to its beginning, so they can be applied one after another.
+    '''
+    patch_lines = patch.splitlines(keepends=True)
+    i = 0
+    while i < len(patch_lines):
+        command = _COMMAND.match(patch_lines[i].rstrip(b'\n'))
+        if not command:
+            raise PdiffError('Unsupported ed command {!r}'.format(patch_lines[i]))
+        i += 1
+        first = int(command.group(1))
+        last = int(command.group(2) or first)
+        text = []
+        if command.group(3) in b'ac':
+            while True:
+                if i >= len(patch_lines):
+                    raise PdiffError('Truncated ed script')
+                line = patch_lines[i]
+                i += 1
+                if line == b'.\n':
+                    break
+                text.append(line)
+        if last > len(lines) or (command.group(3) != b'a' and first < 1):
+            raise PdiffError('ed command out of range {!r}'.format(command.group(0)))
+        if command.group(3) == b'a':
+            lines[first:first] = text
+        else:
+            lines[first - 1:last] = text
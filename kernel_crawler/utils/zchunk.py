@@ -0,0 +1,267 @@
+import os
+import hashlib
+import tempfile
+from collections import namedtuple
+
+import zstandard
+
+from kernel_crawler.utils.download import fetch, fetch_ranges
+
+# A zchunk file (https://github.com/zchunk/zchunk/blob/main/zchunk_format.txt) is a header indexing
+# independently compressed chunks. Chunks are identified by the checksum of their compressed contents,
+# so a new version of a file can be rebuilt from the chunks of an older copy,
+# only downloading the ones that changed.
+
+_MAGIC = b'\0ZCK1'
+
+# checksum type -> (hashlib name, digest size)
+_CHECKSUMS = {
+    0: ('sha1', 20),
+    1: ('sha256', 32),
+    2: ('sha512', 64),
+    3: ('sha512', 16),  # SHA-512/128: the first 128 bits of the SHA-512 digest
+}
+
+_FLAG_STREAMS = 1
+_FLAG_OPTIONAL_ELEMENTS = 2
+# other flags (e.g. 4, uncompressed chunk checksums in the index) change the header layout
+_SUPPORTED_FLAGS = _FLAG_OPTIONAL_ELEMENTS
+
+_COMPRESSION_NONE = 0
+_COMPRESSION_ZSTD = 2
+
+# how many bytes are requested to read the lead of a file whose header size is not known in advance
+_LEAD_SIZE = 4096
+
+# ranges of missing chunks closer than this are fetched with a single request
+_MAX_RANGE_GAP = 64 << 10
+
+# offset: where the compressed chunk starts in the file, length: its compressed size, size: its uncompressed size
+Chunk = namedtuple('Chunk', ['digest', 'offset', 'length', 'size'])
+
+
+class ZchunkError(Exception):
+    pass
+
+
+def _read_int(data, pos):
+    # variable length integers: 7 bits per byte, least significant first, the last byte has its high bit set
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ZchunkError('Truncated zchunk header')
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _checksum(checksum_type):
+    try:
+        return _CHECKSUMS[checksum_type]
+    except KeyError:
+        raise ZchunkError('Unknown zchunk checksum type {}'.format(checksum_type))
+
+
+def header_length(data):
+    '''
+    Return the length of the lead and header of a zchunk file, given (at least) its lead.
+    '''
+    if not data.startswith(_MAGIC):
+        raise ZchunkError('Not a zchunk file')
+    checksum_type, pos = _read_int(data, len(_MAGIC))
+    size, pos = _read_int(data, pos)
+    _, digest_size = _checksum(checksum_type)
+    return pos + digest_size + size
+
+
+class Header(object):
+    '''
+    The parsed header of a zchunk file: its compression type and the dictionary and data chunks,
+    in file order. The dictionary is None if the file has none.
+    '''
+
+    def __init__(self, data):
+        length = header_length(data)
+        if len(data) < length:
+            raise ZchunkError('Truncated zchunk header')
+        self.data = data[:length]
+
+        checksum_type, pos = _read_int(data, len(_MAGIC))
+        _, pos = _read_int(data, pos)
+        _, digest_size = _checksum(checksum_type)
+        pos += digest_size
+
+        # preface
+        pos += digest_size
+        flags, pos = _read_int(data, pos)
+        self.compression, pos = _read_int(data, pos)
+        if flags & _FLAG_STREAMS:
+            raise ZchunkError('zchunk data streams are not supported')
+        if flags & ~_SUPPORTED_FLAGS:
+            raise ZchunkError('Unsupported zchunk flags {:#x}'.format(flags))
+        if self.compression not in (_COMPRESSION_NONE, _COMPRESSION_ZSTD):
+            raise ZchunkError('Unknown zchunk compression type {}'.format(self.compression))
+        if flags & _FLAG_OPTIONAL_ELEMENTS:
+            count, pos = _read_int(data, pos)
+            for _ in range(count):
+                _, pos = _read_int(data, pos)
+                size, pos = _read_int(data, pos)
+                pos += size
+
+        # index
+        _, pos = _read_int(data, pos)
+        chunk_checksum_type, pos = _read_int(data, pos)
+        _, chunk_digest_size = _checksum(chunk_checksum_type)
+        count, pos = _read_int(data, pos)
+        chunks = []
+        offset = length
+        for _ in range(count):
+            digest = data[pos:pos + chunk_digest_size]
+            pos += chunk_digest_size
+            chunk_length, pos = _read_int(data, pos)
+            size, pos = _read_int(data, pos)
+            chunks.append(Chunk(digest, offset, chunk_length, size))
+            offset += chunk_length
+        if not chunks or pos > length:
+            raise ZchunkError('Malformed zchunk index')
+        self.length = offset
+        self.dictionary = chunks[0] if chunks[0].length else None
+        self.chunks = chunks[1:]
+
+
+def read_header(path):
+    '''
+    Return the Header of the zchunk file at path, or None if there is no valid one.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(_LEAD_SIZE)
+            data += f.read(max(header_length(data) - len(data), 0))
+        return Header(data)
+    except (OSError, ZchunkError):
+        return None
+
+
+def _missing_ranges(chunks):
+    ranges = []
+    for chunk in chunks:
+        if ranges and chunk.offset - ranges[-1][1] <= _MAX_RANGE_GAP:
+            ranges[-1][1] = chunk.offset + chunk.length
+        else:
+            ranges.append([chunk.offset, chunk.offset + chunk.length])
+    return ranges
+
+
+def update(url, path, checksum_type, checksum, header_size=None):
+    '''
+    Update the local copy at path of the zchunk file at url, whose checksum (of type checksum_type,
+    e.g. 'sha256') is known in advance. Chunks already present in the previous copy are reused
+    and only the others are downloaded, with range requests.
+    Return the number of bytes downloaded, or None if url does not exist.
+    '''
+    checksum_type = 'sha1' if checksum_type == 'sha' else checksum_type
+    head = fetch_ranges(url, [(0, header_size or _LEAD_SIZE)])
+    if head is None:
+        # no range requests support: download the whole file
+        content = fetch(url)
+        if content is None:
+            return None
+        return _store(path, [content], checksum_type, checksum)
+    head = head[0]
+    length = header_length(head)
+    if length > len(head):
+        rest = fetch_ranges(url, [(len(head), length)])
+        if rest is None:
+            raise ZchunkError('Range request failed for {}'.format(url))
+        head += rest[0]
+    header = Header(head)
+
+    previous = read_header(path)
+    reusable = {}
+    if previous:
+        for chunk in filter(None, [previous.dictionary] + previous.chunks):
+            reusable.setdefault(chunk.digest, chunk)
+
+    chunks = list(filter(None, [header.dictionary] + header.chunks))
+    ranges = _missing_ranges([chunk for chunk in chunks if chunk.digest not in reusable])
+    contents = fetch_ranges(url, ranges) if ranges else []
+    if contents is None:
+        raise ZchunkError('Range request failed for {}'.format(url))
+    downloaded = len(head) + sum(len(content) for content in contents)
+
+    def parts(old):
+        yield header.data
+        missing = iter(zip(ranges, contents))
+        start = stop = content = None
+        for chunk in chunks:
+            if chunk.digest in reusable:
+                old_chunk = reusable[chunk.digest]
+                old.seek(old_chunk.offset)
+                yield old.read(old_chunk.length)
+                continue
+            if start is None or chunk.offset >= stop:
+                (start, stop), content = next(missing)
+            yield content[chunk.offset - start:chunk.offset - start + chunk.length]
+
+    old = open(path, 'rb') if previous else None
+    try:
+        _store(path, parts(old), checksum_type, checksum)
+    finally:
+        if old:
+            old.close()
+    return downloaded
+
+
+def _store(path, parts, checksum_type, checksum):
+    # write the new copy next to the old one, and only replace it once it is verified
+    hasher = hashlib.new(checksum_type)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        size = 0
+        with os.fdopen(fd, 'wb') as f:
+            for part in parts:
+                hasher.update(part)
+                f.write(part)
+                size += len(part)
+        if hasher.hexdigest() != checksum:
+            raise ZchunkError('Checksum mismatch')
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return size
+
+
+def iter_decompressed(path):
+    '''
+    Return an iterator over the decompressed contents of the zchunk file at path, one chunk at a time.
+    '''
+    header = read_header(path)
+    if header is None:
+        raise ZchunkError('Invalid zchunk file {}'.format(path))
+    with open(path, 'rb') as f:
+        if header.compression == _COMPRESSION_NONE:
+            for chunk in header.chunks:
+                f.seek(chunk.offset)
+                yield f.read(chunk.length)
+            return
+
+        try:
+            dictionary = None
+            if header.dictionary:
+                f.seek(header.dictionary.offset)
+                data = zstandard.ZstdDecompressor().decompress(
+                    f.read(header.dictionary.length), max_output_size=header.dictionary.size)
+                dictionary = zstandard.ZstdCompressionDict(data)
+            dctx = zstandard.ZstdDecompressor(dict_data=dictionary)
+            for chunk in header.chunks:
+                if not chunk.length:
+                    continue
+                f.seek(chunk.offset)
+                yield dctx.decompress(f.read(chunk.length), max_output_size=chunk.size)
+        except zstandard.ZstdError as e:
+            raise ZchunkError('Invalid zchunk data in {}: {}'.format(path, e))
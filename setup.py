@@ -35,7 +35,6 @@ setup(name='kernel-crawler',
           'docker',
           'semantic-version',
           'pygit2',
-          'beautifulsoup4',
           'rpmfile',
           'zstandard'
       ],